@@ -0,0 +1,132 @@
+"""Benchmark the authentication hot paths and write the results as JSON
+
+Run from the project root against the configured database, for example:
+
+    python -m benchmarks --output results.json
+    DATABASE_URL=sqlite:///./bench.db python -m benchmarks --create-tables
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# A benchmark logs in far more often from one address than any client should.
+os.environ.setdefault("LOGIN_IP_LIMIT", "1000000000")
+
+from oauth_app.app import crud
+from oauth_app.app import schemas
+from oauth_app.app.config import settings
+from oauth_app.app.database.session import SessionLocal, engine
+from oauth_app.app.services import get_default_services
+
+from benchmarks.load import run_load
+from benchmarks.micro import run_micro
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def ensure_user(email: str, password: str) -> None:
+    db = SessionLocal()
+    try:
+        if crud.get_user_by_email(db, email) is None:
+            crud.create_user(db, schemas.UserCreate(email=email, password=password))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--output", help="File to write the JSON results to, stdout by default."
+    )
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument(
+        "--hash-iterations",
+        type=int,
+        default=10,
+        help="Iterations of the deliberately slow password verification.",
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--login-requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument(
+        "--url",
+        help="Load test a running server at this URL instead of the app in-process.",
+    )
+    parser.add_argument(
+        "--create-tables",
+        action="store_true",
+        help="Create missing tables from the models, for a fresh SQLite stand-in.",
+    )
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--email", default="benchmark@example.com")
+    parser.add_argument("--password", default="benchmark_pass_123")
+    args = parser.parse_args()
+
+    if args.create_tables:
+        from oauth_app.app.database.base import Base
+
+        Base.metadata.create_all(engine)
+    ensure_user(args.email, args.password)
+
+    results = {}
+    try:
+        if not args.skip_micro:
+            results.update(
+                run_micro(
+                    args.email, args.password, args.iterations, args.hash_iterations
+                )
+            )
+        if not args.skip_load:
+            from oauth_app.main import app
+
+            results.update(
+                run_load(
+                    app,
+                    args.url,
+                    args.email,
+                    args.password,
+                    args.requests,
+                    args.login_requests,
+                    args.concurrency,
+                )
+            )
+    finally:
+        get_default_services().hasher.shutdown()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "database": engine.dialect.name,
+            "database_async": settings.DATABASE_ASYNC,
+            "password_hash_scheme": settings.PASSWORD_HASH_SCHEME,
+            "bcrypt_rounds": settings.BCRYPT_ROUNDS,
+            "concurrency": args.concurrency,
+            "target": args.url or "in-process",
+        },
+        "results": results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        sys.stdout.write(output + "\n")
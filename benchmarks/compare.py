@@ -0,0 +1,55 @@
+"""Compare two benchmark result files and flag regressions
+
+    python -m benchmarks.compare baseline.json results.json --threshold 0.1
+
+Exits with status 1 if the median latency of any benchmark grew by more than
+the threshold.
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Tuple
+
+
+def compare(
+    baseline: Dict[str, Any], current: Dict[str, Any], threshold: float
+) -> Tuple[List[str], bool]:
+    """Lines of a comparison table and whether any benchmark regressed."""
+    lines = [f"{'benchmark':<28} {'p50 before':>12} {'p50 after':>12} {'change':>8}"]
+    regressed = False
+    for name, after in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None:
+            lines.append(f"{name:<28} {'-':>12} {after['p50_ms']:>12.4f} {'new':>8}")
+            continue
+        change = after["p50_ms"] / before["p50_ms"] - 1 if before["p50_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressed = True
+        lines.append(
+            f"{name:<28} {before['p50_ms']:>12.4f} {after['p50_ms']:>12.4f}"
+            f" {change:>+8.1%}{flag}"
+        )
+    return lines, regressed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Largest acceptable relative increase of the median latency.",
+    )
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    lines, regressed = compare(baseline, current, args.threshold)
+    print("\n".join(lines))
+    sys.exit(1 if regressed else 0)
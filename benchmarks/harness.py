@@ -0,0 +1,92 @@
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, List
+
+
+def summarize(
+    latencies: List[float], elapsed: float, errors: int = 0
+) -> Dict[str, Any]:
+    """Throughput and latency percentiles, in milliseconds, of a set of samples.
+
+    Args:
+        latencies (List[float]): Seconds taken by each operation.
+        elapsed (float): Wall clock seconds for all of them, concurrency included.
+        errors (int): Operations that failed.
+    """
+    ordered = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        # Nearest rank, so every reported value is an actual sample.
+        index = max(math.ceil(p / 100 * len(ordered)) - 1, 0)
+        return round(ordered[index] * 1000, 4)
+
+    return {
+        "count": len(ordered),
+        "errors": errors,
+        "seconds": round(elapsed, 4),
+        "ops_per_second": round(len(ordered) / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 4),
+        "p50_ms": percentile(50),
+        "p90_ms": percentile(90),
+        "p99_ms": percentile(99),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+def measure(fn: Callable[[], Any], iterations: int, warmup: int = 3) -> Dict[str, Any]:
+    """Time `fn` called back to back, after a few untimed warmup calls."""
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        call_start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - call_start)
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def measure_concurrent(
+    request: Callable[[], Awaitable[int]], requests: int, concurrency: int
+) -> Dict[str, Any]:
+    """Send `requests` requests from `concurrency` concurrent clients.
+
+    Args:
+        request (Callable[[], Awaitable[int]]): Sends one request, returns its status.
+    """
+    latencies: List[float] = []
+    errors = 0
+    remaining = iter(range(requests))
+
+    async def client() -> None:
+        nonlocal errors
+        for _ in remaining:
+            call_start = time.perf_counter()
+            status = await request()
+            latencies.append(time.perf_counter() - call_start)
+            if status >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return summarize(latencies, time.perf_counter() - start, errors)
+
+
+def measure_threaded(
+    request: Callable[[], int], requests: int, concurrency: int
+) -> Dict[str, Any]:
+    """`measure_concurrent` for blocking clients, one thread per client."""
+
+    def timed(_: int):
+        call_start = time.perf_counter()
+        status = request()
+        return time.perf_counter() - call_start, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(timed, range(requests)))
+    elapsed = time.perf_counter() - start
+    errors = sum(1 for _, status in samples if status >= 400)
+    return summarize([latency for latency, _ in samples], elapsed, errors)
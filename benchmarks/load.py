@@ -0,0 +1,137 @@
+"""Concurrent end-to-end load on `POST /token` and `GET /users/me`.
+
+By default requests are sent straight to the ASGI app in this process, which
+measures the application without any network or server overhead. With a base
+URL they go over HTTP to a running server instead.
+"""
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+import requests
+
+from benchmarks.harness import measure_concurrent, measure_threaded
+
+Headers = List[Tuple[bytes, bytes]]
+
+
+class ASGIClient:
+    """Minimal in-process HTTP client for an ASGI app."""
+
+    def __init__(self, app: Any):
+        self.app = app
+
+    async def request(
+        self, method: str, path: str, headers: Headers = (), body: bytes = b""
+    ) -> Tuple[int, bytes]:
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": b"",
+            "root_path": "",
+            "headers": list(headers) + [(b"content-length", str(len(body)).encode())],
+            "client": ("127.0.0.1", 50000),
+            "server": ("benchmark", 80),
+        }
+        sent = False
+        status = 0
+        chunks = []
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                return {"type": "http.disconnect"}
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+
+async def run_load_asgi(
+    app: Any,
+    email: str,
+    password: str,
+    requests_count: int,
+    login_requests: int,
+    concurrency: int,
+) -> Dict[str, Dict[str, Any]]:
+    client = ASGIClient(app)
+    form = urlencode({"username": email, "password": password}).encode()
+    form_headers = [(b"content-type", b"application/x-www-form-urlencoded")]
+
+    status, body = await client.request("POST", "/token", form_headers, form)
+    if status != 200:
+        raise RuntimeError(f"Login failed with {status}: {body!r}")
+    bearer = [(b"authorization", f"Bearer {json.loads(body)['access_token']}".encode())]
+
+    async def login() -> int:
+        return (await client.request("POST", "/token", form_headers, form))[0]
+
+    async def read_me() -> int:
+        return (await client.request("GET", "/users/me", bearer))[0]
+
+    return {
+        "post_token": await measure_concurrent(login, login_requests, concurrency),
+        "get_users_me": await measure_concurrent(read_me, requests_count, concurrency),
+    }
+
+
+def run_load_http(
+    base_url: str,
+    email: str,
+    password: str,
+    requests_count: int,
+    login_requests: int,
+    concurrency: int,
+) -> Dict[str, Dict[str, Any]]:
+    base_url = base_url.rstrip("/")
+    form = {"username": email, "password": password}
+    resp = requests.post(f"{base_url}/token", data=form)
+    resp.raise_for_status()
+    headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount(base_url, adapter)
+
+    def login() -> int:
+        return session.post(f"{base_url}/token", data=form).status_code
+
+    def read_me() -> int:
+        return session.get(f"{base_url}/users/me", headers=headers).status_code
+
+    return {
+        "post_token": measure_threaded(login, login_requests, concurrency),
+        "get_users_me": measure_threaded(read_me, requests_count, concurrency),
+    }
+
+
+def run_load(
+    app: Any,
+    base_url: Optional[str],
+    email: str,
+    password: str,
+    requests_count: int,
+    login_requests: int,
+    concurrency: int,
+) -> Dict[str, Dict[str, Any]]:
+    if base_url:
+        return run_load_http(
+            base_url, email, password, requests_count, login_requests, concurrency
+        )
+    return asyncio.run(
+        run_load_asgi(app, email, password, requests_count, login_requests, concurrency)
+    )
@@ -0,0 +1,48 @@
+"""Single threaded timings of the functions on the authentication hot paths."""
+from typing import Any, Dict
+
+from oauth_app.app import crud
+from oauth_app.app import security
+from oauth_app.app.config import settings
+from oauth_app.app.services import get_default_services
+
+from benchmarks.harness import measure
+
+
+def run_micro(
+    email: str, password: str, iterations: int, hash_iterations: int
+) -> Dict[str, Dict[str, Any]]:
+    services = get_default_services()
+    tokens = services.tokens
+    db = services.database.session_factory()
+    try:
+        user = crud.get_user_by_email(db, email)
+        data = {"sub": user.email, "uid": user.id, "gen": user.token_generation}
+        token = tokens.create_access_token(data, settings.access_token_expires)
+
+        def decode_cold() -> None:
+            tokens.cache.clear()
+            tokens.decode_access_token(token)
+
+        results = {
+            "create_access_token": measure(
+                lambda: tokens.create_access_token(data, settings.access_token_expires),
+                iterations,
+            ),
+            # Signature check included, as for a token seen for the first time.
+            "decode_access_token_cold": measure(decode_cold, iterations),
+            "decode_access_token_cached": measure(
+                lambda: tokens.decode_access_token(token), iterations
+            ),
+            "get_user_by_email": measure(
+                lambda: crud.get_user_by_email(db, email), iterations
+            ),
+            "verify_password": measure(
+                lambda: security.verify_password(db, password, user.hashed_password),
+                hash_iterations,
+                warmup=1,
+            ),
+        }
+    finally:
+        db.close()
+    return results
@@ -9,7 +9,7 @@ from alembic import context
 # Load environment variables
 load_dotenv()
 
-from oauth_app.app.database.session import get_sqlalchemy_url
+from oauth_app.app.database.session import get_database_url
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
@@ -46,7 +46,7 @@ def run_migrations_offline():
     script output.
 
     """
-    url = get_sqlalchemy_url()
+    url = config.attributes.get("url") or get_database_url()
     context.configure(
         url=url,
         target_metadata=target_metadata,
@@ -67,7 +67,7 @@ def run_migrations_online():
 
     """
     configuration = config.get_section(config.config_ini_section)
-    configuration["sqlalchemy.url"] = get_sqlalchemy_url()
+    configuration["sqlalchemy.url"] = config.attributes.get("url") or get_database_url()
     connectable = engine_from_config(
         configuration,
         prefix="sqlalchemy.",
@@ -0,0 +1,147 @@
+from datetime import timedelta
+from functools import lru_cache
+from typing import Optional
+
+from jose.constants import ALGORITHMS
+from pydantic import BaseSettings, PrivateAttr, validator
+
+SIGNING_ALGORITHMS = ALGORITHMS.HMAC | ALGORITHMS.RSA_DS | ALGORITHMS.EC_DS
+
+
+class Settings(BaseSettings):
+    """Application settings, read and validated once from the environment.
+
+    A missing or malformed variable raises a `ValidationError` on import instead
+    of a `KeyError` in the middle of a request.
+    """
+
+    ENVIRONMENT: str = "TEST"
+
+    POSTGRES_USER: str = "postgres"
+    POSTGRES_PASS: str = ""
+    POSTGRES_SERVER: str = "localhost"
+    POSTGRES_DB: str = "db"
+    POSTGRES_DEV_PORT: int = 5432
+    POSTGRES_TEST_PORT: int = 5433
+    DATABASE_ASYNC: bool = False
+    # Full SQLAlchemy URL used instead of the POSTGRES_* settings, for example a
+    # `sqlite:///./bench.db` stand-in when no Postgres is around.
+    DATABASE_URL: Optional[str] = None
+    # Optional read replica, same user, password and database as the primary.
+    POSTGRES_READ_SERVER: Optional[str] = None
+    POSTGRES_READ_PORT: Optional[int] = None
+
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    # Seconds after which a connection is replaced, -1 keeps connections forever.
+    DB_POOL_RECYCLE: int = -1
+    DB_POOL_TIMEOUT: float = 30
+    # Test each connection on checkout, costs a round trip per checkout.
+    DB_POOL_PRE_PING: bool = True
+    # Connections each worker opens at startup in the pools serving requests.
+    DB_POOL_WARMUP: int = 1
+
+    # Production server, see `oauth_app/server.py`. Workers default to the CPU count.
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 8000
+    SERVER_WORKERS: Optional[int] = None
+    # Seconds workers get to finish in-flight requests after a SIGTERM.
+    SERVER_GRACEFUL_TIMEOUT: int = 30
+    # Comma separated proxy IPs, or `*`, whose X-Forwarded-For gives the client IP.
+    SERVER_FORWARDED_ALLOW_IPS: str = "127.0.0.1"
+
+    SECRET_KEY: str
+    ALGORITHM: str
+    ACCESS_TOKEN_EXPIRE_MINUTES: int
+    # Directory of `<kid>.pem` RSA/EC keys, private keys can sign, public keys only verify.
+    JWT_KEYS_DIR: Optional[str] = None
+    # Key that signs new tokens, unset to sign with `SECRET_KEY`.
+    JWT_ACTIVE_KID: Optional[str] = None
+    JWKS_MAX_AGE: int = 300
+    REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    REVOCATION_REFRESH_SECONDS: float = 5
+    # More than the revocations added while the slowest revoking transaction runs.
+    REVOCATION_LOOKBACK_ROWS: int = 1000
+
+    # Scheme for new hashes, bcrypt hashes always stay verifiable.
+    PASSWORD_HASH_SCHEME: str = "bcrypt"
+    BCRYPT_ROUNDS: int = 12
+    ARGON2_TIME_COST: int = 2
+    ARGON2_MEMORY_COST: int = 102400
+    ARGON2_PARALLELISM: int = 8
+    # Verification latency `run_calibrate_hashing.py` aims for.
+    PASSWORD_HASH_TARGET_MS: float = 250
+    PASSWORD_HASH_EXECUTOR: str = "thread"
+    PASSWORD_HASH_WORKERS: Optional[int] = None
+    PASSWORD_HASH_MAX_QUEUE: int = 64
+
+    LOGIN_IP_LIMIT: int = 20
+    LOGIN_IP_PERIOD: float = 60
+    # Failed logins allowed per account before it is locked out for a while.
+    LOGIN_ACCOUNT_LIMIT: int = 5
+    LOGIN_ACCOUNT_PERIOD: float = 300
+    RATE_LIMIT_BACKEND: str = "oauth_app.app.rate_limit.MemoryRateLimiter"
+
+    # Bloom filter of registered emails, lets logins for unknown emails skip the query.
+    EMAIL_FILTER_ENABLED: bool = True
+    EMAIL_FILTER_CAPACITY: int = 1000000
+    EMAIL_FILTER_ERROR_RATE: float = 0.001
+    EMAIL_FILTER_REFRESH_SECONDS: float = 5
+    EMAIL_FILTER_REBUILD_SECONDS: float = 3600
+    # Longer than any transaction that adds a user or changes an email.
+    EMAIL_FILTER_LOOKBACK_SECONDS: float = 60
+
+    USER_IMPORT_BATCH_SIZE: int = 1000
+    USER_EXPORT_BATCH_SIZE: int = 1000
+
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL: float = 60
+    TOKEN_CACHE_SIZE: int = 10000
+    TOKEN_CACHE_TTL: float = 300
+
+    TOKEN_CLAIMS_MODE: bool = False
+    TOKEN_CLAIMS_MAX_STALENESS: int = 300
+
+    _access_token_expires: timedelta = PrivateAttr()
+
+    class Config:
+        case_sensitive = True
+
+    def __init__(self, **values):
+        super().__init__(**values)
+        self._access_token_expires = timedelta(minutes=self.ACCESS_TOKEN_EXPIRE_MINUTES)
+
+    @validator("ALGORITHM")
+    def check_algorithm(cls, v: str) -> str:
+        if v not in SIGNING_ALGORITHMS:
+            raise ValueError(f"Unsupported signing algorithm: {v}")
+        return v
+
+    @validator("PASSWORD_HASH_SCHEME")
+    def check_scheme(cls, v: str) -> str:
+        if v not in ("bcrypt", "argon2"):
+            raise ValueError("Must be either 'bcrypt' or 'argon2'")
+        return v
+
+    @validator("PASSWORD_HASH_EXECUTOR")
+    def check_executor(cls, v: str) -> str:
+        if v not in ("thread", "process"):
+            raise ValueError("Must be either 'thread' or 'process'")
+        return v
+
+    @validator("PASSWORD_HASH_WORKERS", "SERVER_WORKERS")
+    def check_workers(cls, v: Optional[int]) -> Optional[int]:
+        # 0 means "use the CPU count", same as leaving it unset.
+        return v or None
+
+    @property
+    def access_token_expires(self) -> timedelta:
+        return self._access_token_expires
+
+
+@lru_cache()
+def get_settings() -> Settings:
+    return Settings()
+
+
+settings = get_settings()
@@ -1,11 +1,28 @@
-from typing import Union, Dict, Any
+import uuid
+from datetime import datetime, timedelta
+from typing import Union, Dict, Any, Iterator, List, Optional, Sequence, Set, Tuple
 
-from fastapi.encoders import jsonable_encoder
+from sqlalchemy import Integer, any_, bindparam, func, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.engine import Row
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 from oauth_app.app import models
 from oauth_app.app import schemas
-from oauth_app.app.security import get_password_hash
+from oauth_app.app import security
+from oauth_app.app.services import services_of
+
+# Fields of a user update that map straight onto a column.
+USER_UPDATE_COLUMNS = frozenset(
+    column.key for column in models.User.__table__.columns
+) - {"id"}
+
+
+def _is_postgresql(db: Session) -> bool:
+    # The single statement paths rely on RETURNING, other databases (the SQLite
+    # stand-in for benchmarks and tests) take a slower path with the same result.
+    return db.get_bind().dialect.name == "postgresql"
 
 
 def get_user(db: Session, user_id: int):
@@ -16,36 +33,432 @@ def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
 
-def create_user(db: Session, user: Union[schemas.UserCreate, Dict[str, Any]]) -> models.User:
-    fake_hashed_password = get_password_hash(user.password)
-    db_user = models.User(
-        email=user.email,
-        full_name=user.full_name,
-        hashed_password=fake_hashed_password,
-        is_superuser=user.is_superuser,
+def get_max_user_id(db: Session) -> int:
+    return db.execute(select(func.max(models.User.id))).scalar() or 0
+
+
+def iter_user_emails(
+    db: Session, changed_since: Optional[datetime] = None, batch_size: int = 10000
+) -> Iterator[Row]:
+    """Stream the `(email, email_changed_at)` of users from a server-side cursor.
+
+    Args:
+        changed_since (Optional[datetime]): Only users whose email was set at
+            or after this time, every user if None.
+    """
+    stmt = select(models.User.email, models.User.email_changed_at).where(
+        models.User.email.isnot(None)
     )
-    db.add(db_user)
+    if changed_since is not None:
+        stmt = stmt.where(models.User.email_changed_at >= changed_since)
+    result = db.execute(stmt.execution_options(stream_results=True))
+    for rows in result.partitions(batch_size):
+        yield from rows
+
+
+def list_users(
+    db: Session,
+    *,
+    filters: schemas.UserFilter,
+    fields: Sequence[str],
+    after: Optional[int] = None,
+    limit: int = 100,
+) -> List[Row]:
+    """Fetch one page of users in `id` order.
+
+    Pages are found by seeking past the last `id` of the previous page, so every
+    page costs the same however deep it is.
+
+    Args:
+        filters (schemas.UserFilter): Conditions the users must match.
+        fields (Sequence[str]): Columns to fetch, `id` is always fetched.
+        after (Optional[int]): Last `id` of the previous page.
+        limit (int): Maximum number of users to fetch.
+    """
+    user = models.User
+    columns = [user.id] + [getattr(user, field) for field in fields if field != "id"]
+    stmt = select(*columns).order_by(user.id).limit(limit)
+    if after is not None:
+        stmt = stmt.where(user.id > after)
+    return db.execute(stmt.where(*_user_filter_clauses(filters))).all()
+
+
+def _user_filter_clauses(filters: schemas.UserFilter) -> List[Any]:
+    user = models.User
+    clauses = []
+    if filters.is_active is not None:
+        clauses.append(user.is_active.is_(filters.is_active))
+    if filters.is_superuser is not None:
+        clauses.append(user.is_superuser.is_(filters.is_superuser))
+    if filters.email_prefix:
+        prefix = (
+            filters.email_prefix.replace("\\", "\\\\")
+            .replace("%", "\\%")
+            .replace("_", "\\_")
+        )
+        clauses.append(user.email.like(prefix + "%", escape="\\"))
+    return clauses
+
+
+def create_user(
+    db: Session,
+    user: Union[schemas.UserCreate, Dict[str, Any]],
+    hashed_password: Optional[str] = None,
+) -> Optional[models.User]:
+    """Insert a user with a single `INSERT ... ON CONFLICT DO NOTHING RETURNING`.
+
+    Returns:
+        Optional[models.User]: The new user, None if the email is already registered.
+    """
+    if hashed_password is None:
+        hashed_password = security.get_password_hash(db, user.password)
+    values = {
+        "email": user.email,
+        "full_name": user.full_name,
+        "hashed_password": hashed_password,
+        "is_superuser": user.is_superuser,
+    }
+    if not _is_postgresql(db):
+        db_user = models.User(**values)
+        try:
+            # A concurrent insert of the same email fails only this savepoint.
+            with db.begin_nested():
+                db.add(db_user)
+        except IntegrityError:
+            db_user = None
+    else:
+        stmt = (
+            insert(models.User)
+            .values(**values)
+            .on_conflict_do_nothing(index_elements=[models.User.email])
+            .returning(models.User)
+        )
+        db_user = db.execute(select(models.User).from_statement(stmt)).scalars().first()
+    if db_user is not None:
+        # Detach so the commit does not expire the row RETURNING just loaded.
+        db.expunge(db_user)
     db.commit()
-    db.refresh(db_user)
+    if db_user is not None:
+        services_of(db).known_emails.add(db_user.email)
     return db_user
 
 
+def bulk_create_users(db: Session, rows: List[Dict[str, Any]]) -> Set[str]:
+    """Insert many users with one multi-row `INSERT ... ON CONFLICT DO NOTHING`.
+
+    Args:
+        rows (List[Dict[str, Any]]): Column values, `hashed_password` already set.
+
+    Returns:
+        Set[str]: Emails that were inserted, the others were already registered.
+    """
+    if not rows:
+        return set()
+    if _is_postgresql(db):
+        stmt = (
+            insert(models.User)
+            .values(rows)
+            .on_conflict_do_nothing(index_elements=[models.User.email])
+            .returning(models.User.email)
+        )
+        created = set(db.execute(stmt).scalars())
+    else:
+        registered = set(
+            db.execute(
+                select(models.User.email).where(
+                    models.User.email.in_([row["email"] for row in rows])
+                )
+            ).scalars()
+        )
+        rows = [row for row in rows if row["email"] not in registered]
+        if rows:
+            db.execute(models.User.__table__.insert(), rows)
+        created = {row["email"] for row in rows}
+    db.commit()
+    known_emails = services_of(db).known_emails
+    for email in created:
+        known_emails.add(email)
+    return created
+
+
 def update_user(
     db: Session,
     *,
     db_obj: models.User,
-    obj_in: Union[schemas.UserUpdate, Dict[str, Any]]
+    obj_in: Union[schemas.UserUpdate, Dict[str, Any]],
+    hashed_password: Optional[str] = None,
 ) -> models.User:
+    """Apply the fields set in `obj_in` with a single `UPDATE ... RETURNING`.
+
+    A `password` is hashed into `hashed_password`, unless that hash is given.
+
+    Returns:
+        models.User: The updated user, `db_obj` itself if it belongs to `db`.
+    """
     if isinstance(obj_in, dict):
         update_data = obj_in
     else:
         update_data = obj_in.dict(exclude_unset=True)
+    values = {
+        field: value
+        for field, value in update_data.items()
+        if field in USER_UPDATE_COLUMNS
+    }
+    if "email" in values:
+        values["email_changed_at"] = func.now()
+    if update_data.get("password") is not None:
+        values["hashed_password"] = hashed_password or security.get_password_hash(
+            db, update_data["password"]
+        )
+    if not values:
+        return db_obj
 
-    obj_data = jsonable_encoder(db_obj)
-    for field in obj_data:
-        if field in update_data:
-            setattr(db_obj, field, update_data[field])
-    db.add(db_obj)
+    previous_email = db_obj.email
+    stmt = update(models.User).where(models.User.id == db_obj.id).values(values)
+    if _is_postgresql(db):
+        db_obj = (
+            db.execute(
+                select(models.User)
+                .from_statement(stmt.returning(models.User))
+                .execution_options(populate_existing=True)
+            )
+            .scalars()
+            .one()
+        )
+    else:
+        db.execute(stmt.execution_options(synchronize_session=False))
+        db_obj = db.get(models.User, db_obj.id, populate_existing=True)
+    # Detach so the commit does not expire the row RETURNING just loaded.
+    db.expunge(db_obj)
     db.commit()
-    db.refresh(db_obj)
+    context = services_of(db)
+    # Cached principals must not outlive a deactivation or privilege change.
+    context.principal_cache.invalidate(previous_email)
+    context.principal_cache.invalidate(db_obj.email)
+    if db_obj.email != previous_email and db_obj.email is not None:
+        context.known_emails.add(db_obj.email)
     return db_obj
+
+
+def bulk_update_users(
+    db: Session,
+    *,
+    values: Dict[str, Any],
+    ids: Optional[List[int]] = None,
+    filters: Optional[schemas.UserFilter] = None,
+) -> int:
+    """Apply `values` to many users with a single set-based `UPDATE`.
+
+    Targets either `ids`, bound as one array parameter (`id = ANY(:ids)`), or
+    the users matching `filters`.
+
+    Returns:
+        int: The number of users updated.
+
+    Raises:
+        ValueError: If `filters` has no condition, which would update every user.
+    """
+    user = models.User
+    if ids is None:
+        clauses = _user_filter_clauses(filters)
+    elif _is_postgresql(db):
+        clauses = [user.id == any_(bindparam("ids", ids, type_=ARRAY(Integer)))]
+    else:
+        clauses = [user.id.in_(ids)]
+    if not clauses:
+        raise ValueError("Refusing to update users without a condition")
+    stmt = update(user).where(*clauses).values(values)
+    if _is_postgresql(db):
+        emails = (
+            db.execute(
+                stmt.returning(user.email).execution_options(synchronize_session=False)
+            )
+            .scalars()
+            .all()
+        )
+    else:
+        emails = db.execute(select(user.email).where(*clauses)).scalars().all()
+        db.execute(stmt.execution_options(synchronize_session=False))
+    db.commit()
+    principal_cache = services_of(db).principal_cache
+    for email in emails:
+        principal_cache.invalidate(email)
+    return len(emails)
+
+
+def update_password_hash(
+    db: Session, db_obj: models.User, hashed_password: str
+) -> None:
+    db.execute(
+        update(models.User)
+        .where(models.User.id == db_obj.id)
+        .values(hashed_password=hashed_password)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+
+
+def _add_refresh_token(db: Session, user_id: int, family_id: str) -> str:
+    token = security.generate_refresh_token()
+    db.add(
+        models.RefreshToken(
+            user_id=user_id,
+            token_hash=security.hash_refresh_token(token),
+            family_id=family_id,
+            expires_at=datetime.utcnow()
+            + timedelta(days=services_of(db).settings.REFRESH_TOKEN_EXPIRE_DAYS),
+            revoked=False,
+        )
+    )
+    return token
+
+
+def create_refresh_token(db: Session, user_id: int) -> str:
+    """Start a new refresh token family, returns the opaque token."""
+    token = _add_refresh_token(db, user_id, uuid.uuid4().hex)
+    db.commit()
+    return token
+
+
+def rotate_refresh_token(
+    db: Session, token: str
+) -> Optional[Tuple[schemas.Principal, str]]:
+    """Consume a refresh token and issue its successor in the same family.
+
+    The token is consumed and its user loaded by a single `UPDATE ... FROM users
+    ... RETURNING` on the unique `token_hash` index. Presenting a token that was
+    already consumed means it leaked, so the whole family is revoked.
+
+    Returns:
+        Optional[Tuple[schemas.Principal, str]]: The user and the new refresh token,
+            None if the token is unknown, expired, revoked or reused.
+    """
+    token_hash = security.hash_refresh_token(token)
+    now = datetime.utcnow()
+    rt = models.RefreshToken
+    conditions = (
+        rt.token_hash == token_hash,
+        rt.used_at.is_(None),
+        rt.revoked.is_(False),
+        rt.expires_at > now,
+    )
+    columns = (
+        rt.family_id,
+        models.User.id,
+        models.User.email,
+        models.User.full_name,
+        models.User.is_active,
+        models.User.is_superuser,
+        models.User.token_generation,
+    )
+    if _is_postgresql(db):
+        stmt = (
+            update(rt)
+            .where(*conditions, rt.user_id == models.User.id)
+            .values(used_at=now)
+            .returning(*columns)
+            .execution_options(synchronize_session=False)
+        )
+        row = db.execute(stmt).first()
+    else:
+        row = db.execute(
+            select(*columns)
+            .join(models.User, rt.user_id == models.User.id)
+            .where(*conditions)
+        ).first()
+        # The conditional update still lets only one of two racing requests win.
+        if (
+            row is not None
+            and not db.execute(
+                update(rt)
+                .where(*conditions)
+                .values(used_at=now)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+        ):
+            row = None
+    if row is None:
+        reused = (
+            db.query(rt.family_id)
+            .filter(rt.token_hash == token_hash, rt.used_at.isnot(None))
+            .first()
+        )
+        if reused is not None:
+            db.query(rt).filter(rt.family_id == reused.family_id).update(
+                {rt.revoked: True}, synchronize_session=False
+            )
+        db.commit()
+        return None
+    user = schemas.Principal(
+        id=row.id,
+        email=row.email,
+        full_name=row.full_name,
+        is_active=row.is_active,
+        is_superuser=row.is_superuser,
+        token_generation=row.token_generation,
+    )
+    new_token = _add_refresh_token(db, user.id, row.family_id)
+    db.commit()
+    return user, new_token
+
+
+def _prune_token_revocations(db: Session) -> None:
+    # The tokens these rows revoke have expired, they fail verification anyway.
+    db.query(models.TokenRevocation).filter(
+        models.TokenRevocation.expires_at < datetime.utcnow()
+    ).delete(synchronize_session=False)
+
+
+def revoke_access_token(
+    db: Session, jti: str, user_id: int, expires_at: datetime
+) -> None:
+    db.add(models.TokenRevocation(jti=jti, user_id=user_id, expires_at=expires_at))
+    _prune_token_revocations(db)
+    db.commit()
+
+
+def revoke_user_tokens(db: Session, user_id: int) -> Optional[int]:
+    """Revoke every access and refresh token issued to a user so far.
+
+    Returns:
+        Optional[int]: The user's new token generation, None if there is no such user.
+    """
+    stmt = (
+        update(models.User)
+        .where(models.User.id == user_id)
+        .values(token_generation=models.User.token_generation + 1)
+        .execution_options(synchronize_session=False)
+    )
+    if _is_postgresql(db):
+        generation = db.execute(stmt.returning(models.User.token_generation)).scalar()
+    elif db.execute(stmt).rowcount:
+        generation = db.execute(
+            select(models.User.token_generation).where(models.User.id == user_id)
+        ).scalar()
+    else:
+        generation = None
+    if generation is None:
+        db.rollback()
+        return None
+    # Every access token of an older generation has expired by then.
+    expires_at = datetime.utcnow() + services_of(db).settings.access_token_expires
+    db.add(
+        models.TokenRevocation(
+            user_id=user_id, generation=generation, expires_at=expires_at
+        )
+    )
+    db.query(models.RefreshToken).filter(
+        models.RefreshToken.user_id == user_id, models.RefreshToken.revoked.is_(False)
+    ).update({models.RefreshToken.revoked: True}, synchronize_session=False)
+    _prune_token_revocations(db)
+    db.commit()
+    return generation
+
+
+def get_token_revocations(db: Session, after_id: int) -> List[models.TokenRevocation]:
+    return (
+        db.query(models.TokenRevocation)
+        .filter(models.TokenRevocation.id > after_id)
+        .order_by(models.TokenRevocation.id)
+        .all()
+    )
@@ -0,0 +1,133 @@
+"""Async counterparts of everything in `crud`.
+
+Every function accepts either a sync `Session` or an `AsyncSession`. With an
+`AsyncSession` the sync implementation runs through `AsyncSession.run_sync` on
+the asyncpg connection, otherwise it runs in the threadpool. Either way the
+event loop is never blocked and `crud` stays the single source of the queries.
+"""
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
+
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from oauth_app.app import crud
+from oauth_app.app import hashing
+from oauth_app.app import models
+from oauth_app.app import schemas
+from oauth_app.app.services import services_of
+
+AnySession = Union[Session, AsyncSession]
+
+
+async def run(db: AnySession, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Call `fn(sync_session, *args, **kwargs)` without blocking the event loop."""
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args, **kwargs)
+    return await run_in_threadpool(fn, db, *args, **kwargs)
+
+
+async def hash_password(db: AnySession, password: str) -> str:
+    """Hash on the hashing pool of `db`'s services, `run_sync` would hash on the event loop."""
+    hasher = services_of(db).hasher
+    return await hasher.run_async(hashing.hash_password, hasher.policy, password)
+
+
+async def get_user(db: AnySession, user_id: int) -> Optional[models.User]:
+    return await run(db, crud.get_user, user_id)
+
+
+async def get_user_by_email(db: AnySession, email: str) -> Optional[models.User]:
+    return await run(db, crud.get_user_by_email, email)
+
+
+async def list_users(
+    db: AnySession,
+    *,
+    filters: schemas.UserFilter,
+    fields: Sequence[str],
+    after: Optional[int] = None,
+    limit: int = 100,
+) -> List[Row]:
+    return await run(
+        db, crud.list_users, filters=filters, fields=fields, after=after, limit=limit
+    )
+
+
+async def create_user(
+    db: AnySession, user: Union[schemas.UserCreate, Dict[str, Any]]
+) -> Optional[models.User]:
+    hashed_password = await hash_password(db, user.password)
+    return await run(db, crud.create_user, user, hashed_password=hashed_password)
+
+
+async def bulk_create_users(db: AnySession, rows: List[Dict[str, Any]]) -> Set[str]:
+    return await run(db, crud.bulk_create_users, rows)
+
+
+async def update_user(
+    db: AnySession,
+    *,
+    db_obj: models.User,
+    obj_in: Union[schemas.UserUpdate, Dict[str, Any]],
+) -> models.User:
+    if isinstance(obj_in, dict):
+        password = obj_in.get("password")
+    else:
+        password = obj_in.password
+    hashed_password = None
+    if password is not None:
+        hashed_password = await hash_password(db, password)
+    return await run(
+        db,
+        crud.update_user,
+        db_obj=db_obj,
+        obj_in=obj_in,
+        hashed_password=hashed_password,
+    )
+
+
+async def bulk_update_users(
+    db: AnySession,
+    *,
+    values: Dict[str, Any],
+    ids: Optional[List[int]] = None,
+    filters: Optional[schemas.UserFilter] = None,
+) -> int:
+    return await run(
+        db, crud.bulk_update_users, values=values, ids=ids, filters=filters
+    )
+
+
+async def update_password_hash(
+    db: AnySession, db_obj: models.User, hashed_password: str
+) -> None:
+    return await run(db, crud.update_password_hash, db_obj, hashed_password)
+
+
+async def create_refresh_token(db: AnySession, user_id: int) -> str:
+    return await run(db, crud.create_refresh_token, user_id)
+
+
+async def rotate_refresh_token(
+    db: AnySession, token: str
+) -> Optional[Tuple[schemas.Principal, str]]:
+    return await run(db, crud.rotate_refresh_token, token)
+
+
+async def revoke_access_token(
+    db: AnySession, jti: str, user_id: int, expires_at: datetime
+) -> None:
+    return await run(db, crud.revoke_access_token, jti, user_id, expires_at)
+
+
+async def revoke_user_tokens(db: AnySession, user_id: int) -> Optional[int]:
+    return await run(db, crud.revoke_user_tokens, user_id)
+
+
+async def get_token_revocations(
+    db: AnySession, after_id: int
+) -> List[models.TokenRevocation]:
+    return await run(db, crud.get_token_revocations, after_id)
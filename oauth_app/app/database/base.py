@@ -1,2 +1,4 @@
 from oauth_app.app.database.base_class import Base  # noqa
 from oauth_app.app.models import User  # noqa
+from oauth_app.app.models import RefreshToken  # noqa
+from oauth_app.app.models import TokenRevocation  # noqa
@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
 from sqlalchemy.orm import Session
 from alembic.config import Config as AlembicConfig
@@ -10,13 +10,16 @@ from oauth_app.app import crud
 from oauth_app.app import schemas
 
 
-def migrate_db(root_dir: Union[str, Path] = ".") -> None:
+def migrate_db(root_dir: Union[str, Path] = ".", url: Optional[str] = None) -> None:
     """Migrate (commit) the database revisions to the database.
 
     Args:
         root_dir (Union[str, Path]): Root directory of this project, needed in order to find the `alembic.ini` file.
+        url (Optional[str]): Database to migrate instead of the configured one.
     """
     alembic_cfg = AlembicConfig(os.path.join(root_dir, "alembic.ini"))
+    if url is not None:
+        alembic_cfg.attributes["url"] = url
     command.upgrade(alembic_cfg, "head")
 
 
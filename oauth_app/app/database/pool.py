@@ -0,0 +1,65 @@
+import threading
+import time
+from typing import Any, Dict
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+class CheckoutTimingMixin:
+    """Record how long checkouts wait for a connection.
+
+    Waits only grow once every pooled and overflow connection is in use, so the
+    totals tell whether `DB_POOL_SIZE` and `DB_MAX_OVERFLOW` are too small.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._wait_lock = threading.Lock()
+        self._checkouts = 0
+        self._wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._wait_lock:
+                self._timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._wait_lock:
+                self._checkouts += 1
+                self._wait_seconds += waited
+                self._max_wait_seconds = max(self._max_wait_seconds, waited)
+
+    def recreate(self):
+        # Pools are recreated on invalidation, carry the totals over.
+        pool = super().recreate()
+        pool._checkouts = self._checkouts
+        pool._wait_seconds = self._wait_seconds
+        pool._max_wait_seconds = self._max_wait_seconds
+        pool._timeouts = self._timeouts
+        return pool
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "checkouts": self._checkouts,
+            "wait_seconds_total": self._wait_seconds,
+            "wait_seconds_max": self._max_wait_seconds,
+            "timeouts": self._timeouts,
+        }
+
+
+class TimedQueuePool(CheckoutTimingMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    pass
@@ -1,22 +1,265 @@
-import os
+import threading
+from typing import Any, Callable, Dict, Optional
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker
 
+from oauth_app.app import config
+from oauth_app.app.config import Settings
+from oauth_app.app.database.pool import TimedAsyncQueuePool, TimedQueuePool
 
-def get_sqlalchemy_url():
-    environment = os.getenv("ENVIRONMENT", "TEST")
-    user = os.getenv("POSTGRES_USER", "postgres")
-    password = os.getenv("POSTGRES_PASS", "")
-    server = os.getenv("POSTGRES_SERVER", "localhost")
-    db = os.getenv("POSTGRES_DB", "db")
-    dev_db_port = os.environ["POSTGRES_DEV_PORT"]
-    test_db_port = os.environ["POSTGRES_TEST_PORT"]
-    port = dev_db_port if environment == "DEV" else test_db_port
-    return f"postgresql://{user}:{password}@{server}:{port}/{db}"
 
+def get_sqlalchemy_url(
+    driver: str = "postgresql",
+    server: Optional[str] = None,
+    port: Optional[int] = None,
+    settings: Optional[Settings] = None,
+):
+    settings = settings or config.settings
+    user = settings.POSTGRES_USER
+    password = settings.POSTGRES_PASS
+    server = server or settings.POSTGRES_SERVER
+    db = settings.POSTGRES_DB
+    dev_db_port = settings.POSTGRES_DEV_PORT
+    test_db_port = settings.POSTGRES_TEST_PORT
+    if port is None:
+        port = dev_db_port if settings.ENVIRONMENT == "DEV" else test_db_port
+    return f"{driver}://{user}:{password}@{server}:{port}/{db}"
 
-SQLALCHEMY_DATABASE_URL = get_sqlalchemy_url()
 
-engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def get_database_url(
+    asynchronous: bool = False, settings: Optional[Settings] = None
+) -> str:
+    """URL of the primary database, `DATABASE_URL` if set.
+
+    Args:
+        asynchronous (bool): Use the asyncio driver of the database.
+        settings (Optional[Settings]): Defaults to the settings from the environment.
+    """
+    settings = settings or config.settings
+    url = settings.DATABASE_URL or get_sqlalchemy_url(settings=settings)
+    if asynchronous:
+        scheme, _, rest = url.partition("://")
+        url = f"{ASYNC_DRIVERS.get(scheme, scheme)}://{rest}"
+    return url
+
+
+def get_pool_options(url: str, settings: Optional[Settings] = None) -> Dict[str, Any]:
+    settings = settings or config.settings
+    options = {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_pre_ping": settings.DB_POOL_PRE_PING,
+    }
+    if url.startswith("sqlite"):
+        # Sessions are handed between the event loop and threadpool threads.
+        options["connect_args"] = {"check_same_thread": False}
+    return options
+
+
+class Database:
+    """Engines and session factories of one configuration, each built on first use.
+
+    Building them lazily keeps the database drivers out of startup until they
+    are needed. Read-only request paths, such as resolving the current user, use
+    the replica when `POSTGRES_READ_SERVER` is set, otherwise the read engine
+    and factory are the primary ones. With `DATABASE_ASYNC` request paths use
+    asyncpg backed `AsyncSession`s, the sync engine is still used by
+    migrations, scripts and tests.
+
+    Args:
+        settings (Settings): Connection and pool settings.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.url = get_database_url(settings=settings)
+        self.read_replica = settings.POSTGRES_READ_SERVER is not None
+        self.asynchronous = settings.DATABASE_ASYNC
+        # Copied into `Session.info` of every session the factories make.
+        self.session_info: Dict[str, Any] = {}
+        self._created: Dict[str, Any] = {}
+        # Reentrant, building a session factory builds its engine.
+        self._lock = threading.RLock()
+
+    def _lazy(self, name: str, build: Callable[[], Any]) -> Any:
+        if name not in self._created:
+            with self._lock:
+                if name not in self._created:
+                    self._created[name] = build()
+        return self._created[name]
+
+    def _read_url(self, driver: str = "postgresql") -> str:
+        return get_sqlalchemy_url(
+            driver,
+            server=self.settings.POSTGRES_READ_SERVER,
+            port=self.settings.POSTGRES_READ_PORT,
+            settings=self.settings,
+        )
+
+    def _create_engine(self, url: str) -> Engine:
+        return create_engine(
+            url, poolclass=TimedQueuePool, **get_pool_options(url, self.settings)
+        )
+
+    def _create_async_engine(self, url: str) -> Any:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        return create_async_engine(
+            url, poolclass=TimedAsyncQueuePool, **get_pool_options(url, self.settings)
+        )
+
+    def _sessionmaker(self, bind: Engine) -> sessionmaker:
+        return sessionmaker(
+            autocommit=False, autoflush=False, bind=bind, info=self.session_info
+        )
+
+    def _async_sessionmaker(self, bind: Any) -> sessionmaker:
+        from sqlalchemy.ext.asyncio import AsyncSession
+
+        return sessionmaker(
+            bind,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False,
+            info=self.session_info,
+        )
+
+    @property
+    def engine(self) -> Engine:
+        return self._lazy("engine", lambda: self._create_engine(self.url))
+
+    @property
+    def session_factory(self) -> sessionmaker:
+        return self._lazy("session_factory", lambda: self._sessionmaker(self.engine))
+
+    @property
+    def read_engine(self) -> Engine:
+        if not self.read_replica:
+            return self.engine
+        return self._lazy("read_engine", lambda: self._create_engine(self._read_url()))
+
+    @property
+    def read_session_factory(self) -> sessionmaker:
+        if not self.read_replica:
+            return self.session_factory
+        return self._lazy(
+            "read_session_factory", lambda: self._sessionmaker(self.read_engine)
+        )
+
+    @property
+    def async_engine(self) -> Optional[Any]:
+        """The asyncio engine of the primary, None unless `DATABASE_ASYNC` is set."""
+        if not self.asynchronous:
+            return None
+        return self._lazy(
+            "async_engine",
+            lambda: self._create_async_engine(
+                get_database_url(asynchronous=True, settings=self.settings)
+            ),
+        )
+
+    @property
+    def async_session_factory(self) -> Optional[sessionmaker]:
+        if not self.asynchronous:
+            return None
+        return self._lazy(
+            "async_session_factory", lambda: self._async_sessionmaker(self.async_engine)
+        )
+
+    @property
+    def async_read_engine(self) -> Optional[Any]:
+        if not (self.asynchronous and self.read_replica):
+            return self.async_engine
+        return self._lazy(
+            "async_read_engine",
+            lambda: self._create_async_engine(self._read_url("postgresql+asyncpg")),
+        )
+
+    @property
+    def async_read_session_factory(self) -> Optional[sessionmaker]:
+        if not (self.asynchronous and self.read_replica):
+            return self.async_session_factory
+        return self._lazy(
+            "async_read_session_factory",
+            lambda: self._async_sessionmaker(self.async_read_engine),
+        )
+
+    @property
+    def request_session_factory(self) -> sessionmaker:
+        """Sessions for request paths, asyncio ones with `DATABASE_ASYNC`."""
+        return self.async_session_factory or self.session_factory
+
+    @property
+    def request_read_session_factory(self) -> sessionmaker:
+        return self.async_read_session_factory or self.read_session_factory
+
+    def pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Connection counts and checkout wait times of every engine created so far."""
+        engines = {
+            "primary": self._created.get("engine"),
+            "replica": self._created.get("read_engine"),
+            "primary_async": self._created.get("async_engine"),
+            "replica_async": self._created.get("async_read_engine"),
+        }
+        return {
+            name: getattr(bound, "sync_engine", bound).pool.stats()
+            for name, bound in engines.items()
+            if bound is not None
+        }
+
+    def _request_engines(self) -> set:
+        if self.asynchronous:
+            return {self.async_engine, self.async_read_engine}
+        return {self.engine, self.read_engine}
+
+    def warm_up(self, connections: int) -> None:
+        """Open `connections` connections in each pool the sync request paths use.
+
+        The first requests a worker serves then skip connection setup, and an
+        unreachable database shows up at startup rather than on a request.
+        """
+        for bound in self._request_engines():
+            held = []
+            try:
+                for _ in range(min(connections, self.settings.DB_POOL_SIZE)):
+                    held.append(bound.connect())
+            finally:
+                for conn in held:
+                    conn.close()
+
+    async def warm_up_async(self, connections: int) -> None:
+        """`warm_up` for the asyncio engines."""
+        for bound in self._request_engines():
+            held = []
+            try:
+                for _ in range(min(connections, self.settings.DB_POOL_SIZE)):
+                    held.append(await bound.connect())
+            finally:
+                for conn in held:
+                    await conn.close()
+
+    async def dispose_async(self) -> None:
+        """Close the pooled connections of the asyncio engines created so far."""
+        for name in ("async_engine", "async_read_engine"):
+            if name in self._created:
+                await self._created[name].dispose()
+
+
+# The names these used to be module constants under, now attributes of the
+# database of the default services, built on first access.
+_LAZY_ATTRIBUTES = {"engine": "engine", "SessionLocal": "session_factory"}
+
+
+def __getattr__(name: str) -> Any:
+    if name in _LAZY_ATTRIBUTES:
+        from oauth_app.app.services import get_default_services
+
+        return getattr(get_default_services().database, _LAZY_ATTRIBUTES[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
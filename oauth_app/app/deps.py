@@ -1,23 +1,66 @@
-import os
-
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
-from jose import JWTError, jwt
+from jose import JWTError
 
 from oauth_app.app import models
 from oauth_app.app import schemas
-from oauth_app.app import crud
-from oauth_app.app.database.session import SessionLocal
+from oauth_app.app import crud_async
+from oauth_app.app.revocation import refresh_revocations
 from oauth_app.app.security import fake_decode_token
+from oauth_app.app.services import Services
+
+
+def get_services(request: Request) -> Services:
+    """The services of the app serving the request, see `main.create_app`."""
+    return request.app.state.services
+
 
 # Dependency
-def get_db():
-    db = SessionLocal()
+async def get_db(services: Services = Depends(get_services)):
+    """A session of the app's primary database.
+
+    Request paths go through `crud_async`, which accepts either kind of session,
+    so this is an `AsyncSession` with `DATABASE_ASYNC` and a sync one otherwise.
+    """
+    factory = services.database.request_session_factory
+    if services.database.asynchronous:
+        async with factory() as db:
+            yield db
+        return
+    db = factory()
     try:
         yield db
     finally:
-        db.close()
+        # Only a session still in a transaction has a connection to give back.
+        if db.in_transaction():
+            await run_in_threadpool(db.close)
+        else:
+            db.close()
+
+
+async def get_read_db(
+    services: Services = Depends(get_services),
+    db: crud_async.AnySession = Depends(get_db),
+):
+    """A session for read-only paths, on the read replica if there is one.
+
+    Without a replica this is the request's `get_db` session itself, so a
+    request shares one session for both.
+    """
+    if not services.database.read_replica:
+        yield db
+        return
+    factory = services.database.request_read_session_factory
+    if services.database.asynchronous:
+        async with factory() as read_db:
+            yield read_db
+        return
+    read_db = factory()
+    try:
+        yield read_db
+    finally:
+        await run_in_threadpool(read_db.close)
 
 
 # token is the path to the URL that provides the user a token
@@ -25,26 +68,40 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 async def get_current_user(
-    db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)
+    db: crud_async.AnySession = Depends(get_read_db),
+    token: str = Depends(oauth2_scheme),
+    services: Services = Depends(get_services),
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    secret_key = os.environ["SECRET_KEY"]
-    algorithm = os.environ["ALGORITHM"]
     try:
-        payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+        payload = services.tokens.decode_access_token(token)
         email: str = payload.get("sub")
         if email is None:
             raise credentials_exception
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = crud.get_user_by_email(db, token_data.email)
-    if user is None:
+    await refresh_revocations(db, services.revocation_index)
+    if services.revocation_index.is_revoked(payload):
+        raise credentials_exception
+    if services.settings.TOKEN_CLAIMS_MODE:
+        user = services.tokens.principal_from_claims(payload)
+        if user is not None:
+            return user
+    principal_cache = services.principal_cache
+    user = principal_cache.get(token_data.email)
+    if user is not None:
+        return user
+    db_user = await crud_async.get_user_by_email(db, token_data.email)
+    if db_user is None:
         raise credentials_exception
+    # Cache a detached snapshot, the ORM instance is bound to this request's session.
+    user = schemas.User.from_orm(db_user)
+    principal_cache.set(token_data.email, user)
     return user
     # user = fake_decode_token(db, token)
     # if not user:
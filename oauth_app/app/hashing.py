@@ -0,0 +1,290 @@
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from oauth_app.app.config import Settings
+from oauth_app.app.metrics import PASSWORD_HASH_SECONDS
+
+if TYPE_CHECKING:
+    from passlib.context import CryptContext
+
+
+def build_crypt_context(settings: Settings) -> "CryptContext":
+    """Hashing policy from the settings.
+
+    New hashes use `PASSWORD_HASH_SCHEME` with the configured cost. Hashes made
+    with another scheme or cost still verify but are flagged for rehashing, so
+    changing the policy migrates users as they log in.
+    """
+    # passlib is imported here, startup only pays for it once a password is hashed.
+    from passlib.context import CryptContext
+
+    schemes = [settings.PASSWORD_HASH_SCHEME]
+    if "bcrypt" not in schemes:
+        schemes.append("bcrypt")
+    return CryptContext(
+        schemes=schemes,
+        deprecated="auto",
+        bcrypt__default_rounds=settings.BCRYPT_ROUNDS,
+        bcrypt__min_rounds=settings.BCRYPT_ROUNDS,
+        bcrypt__max_rounds=settings.BCRYPT_ROUNDS,
+        argon2__time_cost=settings.ARGON2_TIME_COST,
+        argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+        argon2__parallelism=settings.ARGON2_PARALLELISM,
+    )
+
+
+_crypt_contexts: Dict[str, "CryptContext"] = {}
+_dummy_hashes: Dict[str, str] = {}
+
+
+def crypt_context(policy: str) -> "CryptContext":
+    """The `CryptContext` of a policy string, built once per process.
+
+    Hashing jobs receive the policy of their pool as a string because a
+    `CryptContext` cannot be pickled into a process pool.
+    """
+    context = _crypt_contexts.get(policy)
+    if context is None:
+        from passlib.context import CryptContext
+
+        context = _crypt_contexts.setdefault(policy, CryptContext.from_string(policy))
+    return context
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when the hashing pool cannot accept another job."""
+
+
+def verify(policy: str, plain_password: str, hashed_password: str) -> bool:
+    """Module level so it can be pickled into a process pool."""
+    return crypt_context(policy).verify(plain_password, hashed_password)
+
+
+def verify_and_update(
+    policy: str, plain_password: str, hashed_password: str
+) -> Tuple[bool, Optional[str]]:
+    """Verify and, if the hash is outdated, also return a new hash.
+
+    Module level so it can be pickled into a process pool.
+    """
+    return crypt_context(policy).verify_and_update(plain_password, hashed_password)
+
+
+def hash_password(policy: str, password: str) -> str:
+    """Module level so it can be pickled into a process pool."""
+    return crypt_context(policy).hash(password)
+
+
+def dummy_hash(policy: str) -> str:
+    """A hash of a random password under `policy`.
+
+    Verifying against it when a user does not exist makes unknown emails take as
+    long to reject as wrong passwords.
+    """
+    hashed = _dummy_hashes.get(policy)
+    if hashed is None:
+        hashed = _dummy_hashes.setdefault(
+            policy, crypt_context(policy).hash(os.urandom(16).hex())
+        )
+    return hashed
+
+
+class PasswordHashingPool:
+    """Bounded executor used to run password hashing off the event loop.
+
+    At most `max_workers + max_queue` jobs are admitted at once. Anything past
+    that raises `HashingPoolSaturated` instead of queueing without limit, so the
+    API can shed load with a 503 rather than let latency grow unbounded. Bulk
+    work submitted with `map` holds at most `max_bulk` of those slots, so it
+    never crowds out logins.
+
+    Args:
+        settings (Settings): Settings the hashing policy is built from.
+        kind (str): Either "thread" or "process".
+        max_workers (Optional[int]): Number of workers, defaults to the CPU count.
+        max_queue (int): Number of jobs allowed to wait for a free worker.
+        max_bulk (Optional[int]): Slots bulk work may hold at once, defaults to
+            half the workers.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        kind: str = "thread",
+        max_workers: Optional[int] = None,
+        max_queue: int = 64,
+        max_bulk: Optional[int] = None,
+    ):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown hashing executor kind: {kind}")
+        self.settings = settings
+        self.kind = kind
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+        self.max_bulk = max_bulk or max(1, self.max_workers // 2)
+        self._bulk_slots = threading.BoundedSemaphore(self.max_bulk)
+        self._executor: Optional[Executor] = None
+        self._lock = threading.Lock()
+        self._policy: Optional[str] = None
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def policy(self) -> str:
+        """The hashing policy of `settings` as a string, for `crypt_context`.
+
+        Built on first use, startup only pays for passlib once a password is
+        hashed.
+        """
+        if self._policy is None:
+            with self._lock:
+                if self._policy is None:
+                    self._policy = build_crypt_context(self.settings).to_string()
+        return self._policy
+
+    @property
+    def in_flight(self) -> int:
+        """Jobs running or waiting for a worker."""
+        return self._in_flight
+
+    def _get_executor(self) -> Executor:
+        # Created lazily so importing this module never spawns threads or processes.
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == "process":
+                        self._executor = ProcessPoolExecutor(
+                            max_workers=self.max_workers
+                        )
+                    else:
+                        self._executor = ThreadPoolExecutor(
+                            max_workers=self.max_workers,
+                            thread_name_prefix="password-hashing",
+                        )
+        return self._executor
+
+    def submit(self, fn: Callable[..., Any], *args: Any, block: bool = False) -> Future:
+        """Schedule `fn(*args)` on the pool.
+
+        Raises:
+            HashingPoolSaturated: If `block` is False and every slot is taken.
+        """
+        if not self._slots.acquire(blocking=block):
+            raise HashingPoolSaturated("Password hashing pool is saturated")
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        with self._in_flight_lock:
+            self._in_flight += 1
+        timer = PASSWORD_HASH_SECONDS.labels(getattr(fn, "__name__", "other"))
+        start = time.perf_counter()
+
+        def done(_: Future) -> None:
+            timer.observe(time.perf_counter() - start)
+            with self._in_flight_lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+        future.add_done_callback(done)
+        return future
+
+    def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def map(
+        self, fn: Callable[..., Any], iterable: Iterable[Any], *args: Any
+    ) -> List[Any]:
+        """Run `fn(*args, item)` for each item of `iterable` as bulk work, such as
+        an import.
+
+        Waits for free slots instead of failing, and leaves all but `max_bulk`
+        slots to jobs from `submit`, across every concurrent `map`.
+        """
+        futures = []
+        for item in iterable:
+            self._bulk_slots.acquire()
+            try:
+                future = self.submit(fn, *args, item, block=True)
+            except BaseException:
+                self._bulk_slots.release()
+                raise
+            future.add_done_callback(lambda _: self._bulk_slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+def measure_hash_ms(context: "CryptContext", samples: int = 3) -> float:
+    """Median time, in milliseconds, `context` takes to hash a password."""
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash("calibration-password")
+        timings.append((time.perf_counter() - start) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+
+def calibrate(scheme: str, target_ms: float, settings: Settings) -> Dict[str, Any]:
+    """Find the highest cost whose hash time on this host stays under `target_ms`.
+
+    bcrypt cost doubles per round, so rounds are picked from a single measurement.
+    argon2 keeps the memory cost and parallelism of `settings` and only raises
+    the time cost.
+
+    Returns:
+        Dict[str, Any]: Recommended settings along with the measured latency.
+    """
+    from passlib.context import CryptContext
+
+    if scheme == "bcrypt":
+        base_rounds = 8
+        base_ms = measure_hash_ms(
+            CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=base_rounds)
+        )
+        rounds = base_rounds
+        while rounds < 31 and base_ms * 2 ** (rounds + 1 - base_rounds) <= target_ms:
+            rounds += 1
+        recommended = {"PASSWORD_HASH_SCHEME": "bcrypt", "BCRYPT_ROUNDS": rounds}
+        context = CryptContext(schemes=["bcrypt"], bcrypt__default_rounds=rounds)
+    elif scheme == "argon2":
+        time_cost = 1
+        while True:
+            context = CryptContext(
+                schemes=["argon2"],
+                argon2__time_cost=time_cost + 1,
+                argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+                argon2__parallelism=settings.ARGON2_PARALLELISM,
+            )
+            if measure_hash_ms(context) > target_ms:
+                break
+            time_cost += 1
+        recommended = {
+            "PASSWORD_HASH_SCHEME": "argon2",
+            "ARGON2_TIME_COST": time_cost,
+            "ARGON2_MEMORY_COST": settings.ARGON2_MEMORY_COST,
+            "ARGON2_PARALLELISM": settings.ARGON2_PARALLELISM,
+        }
+        context = CryptContext(
+            schemes=["argon2"],
+            argon2__time_cost=time_cost,
+            argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+            argon2__parallelism=settings.ARGON2_PARALLELISM,
+        )
+    else:
+        raise ValueError(f"Unknown hashing scheme: {scheme}")
+    return {"settings": recommended, "measured_ms": measure_hash_ms(context)}
@@ -0,0 +1,116 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from jose import jwk
+from jose.backends.base import Key
+from jose.constants import ALGORITHMS
+from jose.exceptions import JWTError
+
+from oauth_app.app.config import Settings
+
+EC_CURVE_ALGORITHMS = {
+    "secp256r1": ALGORITHMS.ES256,
+    "secp384r1": ALGORITHMS.ES384,
+    "secp521r1": ALGORITHMS.ES512,
+}
+
+
+class KeyRing:
+    """Every key used to sign or verify access tokens, parsed once at startup.
+
+    Tokens are signed with a single active key and verified with whichever key
+    their `kid` header names, so keys can be rotated by adding the new key,
+    switching the active `kid` and dropping the old key once its tokens expire.
+    The symmetric `SECRET_KEY` key has no `kid`.
+
+    Args:
+        signing_kid (Optional[str]): `kid` of the signing key, None for the secret key.
+        signing_keys (Dict[Optional[str], Tuple[str, Key]]): Algorithm and key able
+            to sign, by `kid`.
+        verify_keys (Dict[Optional[str], Tuple[str, Key]]): Algorithm and key used to
+            verify, by `kid`. Public keys for asymmetric algorithms.
+        public_jwks (List[Dict[str, Any]]): Public JWKs published for other services.
+    """
+
+    def __init__(
+        self,
+        signing_kid: Optional[str],
+        signing_keys: Dict[Optional[str], Tuple[str, Key]],
+        verify_keys: Dict[Optional[str], Tuple[str, Key]],
+        public_jwks: List[Dict[str, Any]],
+    ):
+        if signing_kid not in signing_keys:
+            raise ValueError(f"No private key found for the active kid: {signing_kid}")
+        self.signing_kid = signing_kid
+        self.signing_algorithm, self.signing_key = signing_keys[signing_kid]
+        self.verify_keys = verify_keys
+        self.headers = {"kid": signing_kid} if signing_kid else None
+        # Pre-serialized so the JWKS endpoint only copies bytes.
+        self.jwks = json.dumps({"keys": public_jwks}, separators=(",", ":")).encode()
+        self.jwks_etag = f'"{hashlib.sha256(self.jwks).hexdigest()[:32]}"'
+
+    def verification_key(self, kid: Optional[str]) -> Tuple[str, Key]:
+        """Algorithm and key for the `kid` in a token header.
+
+        Raises:
+            JWTError: If no key has that `kid`.
+        """
+        try:
+            return self.verify_keys[kid]
+        except KeyError:
+            raise JWTError(f"Unknown key id: {kid}")
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "KeyRing":
+        signing_keys: Dict[Optional[str], Tuple[str, Key]] = {}
+        verify_keys: Dict[Optional[str], Tuple[str, Key]] = {}
+        public_jwks = []
+        if settings.ALGORITHM in ALGORITHMS.HMAC:
+            secret_key = jwk.construct(settings.SECRET_KEY, settings.ALGORITHM)
+            signing_keys[None] = verify_keys[None] = (settings.ALGORITHM, secret_key)
+        if settings.JWT_KEYS_DIR:
+            for path in sorted(Path(settings.JWT_KEYS_DIR).glob("*.pem")):
+                kid = path.stem
+                algorithm, key = load_pem_key(path.read_bytes(), settings.ALGORITHM)
+                if key.is_public():
+                    public_key = key
+                else:
+                    signing_keys[kid] = (algorithm, key)
+                    public_key = key.public_key()
+                verify_keys[kid] = (algorithm, public_key)
+                public_jwk = public_key.to_dict()
+                public_jwk.update({"kid": kid, "alg": algorithm, "use": "sig"})
+                public_jwks.append(public_jwk)
+        return cls(settings.JWT_ACTIVE_KID, signing_keys, verify_keys, public_jwks)
+
+
+def load_pem_key(pem: bytes, preferred_algorithm: str) -> Tuple[str, Key]:
+    """Parse a PEM private or public key and pick its signing algorithm.
+
+    RSA keys use `preferred_algorithm` if it is an RSA algorithm, RS256 otherwise.
+    EC keys use the algorithm matching their curve.
+
+    Raises:
+        ValueError: If the key type is not supported by python-jose.
+    """
+    try:
+        parsed = serialization.load_pem_private_key(pem, password=None)
+    except ValueError:
+        parsed = serialization.load_pem_public_key(pem)
+    if isinstance(parsed, (rsa.RSAPrivateKey, rsa.RSAPublicKey)):
+        if preferred_algorithm in ALGORITHMS.RSA_DS:
+            algorithm = preferred_algorithm
+        else:
+            algorithm = ALGORITHMS.RS256
+    elif isinstance(parsed, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        algorithm = EC_CURVE_ALGORITHMS.get(parsed.curve.name)
+        if algorithm is None:
+            raise ValueError(f"Unsupported EC curve: {parsed.curve.name}")
+    else:
+        # python-jose has no EdDSA support.
+        raise ValueError(f"Unsupported key type: {type(parsed).__name__}")
+    return algorithm, jwk.construct(pem, algorithm)
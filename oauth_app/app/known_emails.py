@@ -0,0 +1,148 @@
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Iterable, List, Optional, Tuple
+
+
+class BloomFilter:
+    """Set membership with no false negatives and a bounded false positive rate.
+
+    Args:
+        capacity (int): Number of items the filter is sized for.
+        error_rate (float): False positive rate once `capacity` items are added.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        num_bits = -capacity * math.log(error_rate) / math.log(2) ** 2
+        self.num_bits = max(8, math.ceil(num_bits))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self._bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item: str) -> List[int]:
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+
+class KnownEmails:
+    """Bloom filter of every registered email, to reject unknown emails without a query.
+
+    The filter is built from the `users` table when the app starts and rebuilt
+    every `rebuild_interval` seconds in the background. Emails set through this
+    process are added to it directly. Emails set by other workers, by new users
+    or email changes alike, are picked up by fetching the users whose
+    `email_changed_at` is past the latest one seen, at most every
+    `refresh_interval` seconds and only when an email misses the filter. Each
+    refresh reads `lookback` seconds further back, so rows from transactions
+    that committed late are not missed.
+
+    Args:
+        capacity (int): Minimum number of emails the filter is sized for.
+        error_rate (float): False positive rate at capacity.
+        refresh_interval (float): Seconds between incremental refreshes.
+        rebuild_interval (float): Seconds between full rebuilds, which drop the
+            emails no user has anymore.
+        lookback (float): Seconds each refresh reads before the latest change seen.
+        clock (Callable[[], float]): Monotonic clock.
+    """
+
+    def __init__(
+        self,
+        capacity: int,
+        error_rate: float,
+        refresh_interval: float,
+        rebuild_interval: float,
+        lookback: float = 60,
+        clock=time.monotonic,
+    ):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.lookback = timedelta(seconds=lookback)
+        self._clock = clock
+        self._filter: Optional[BloomFilter] = None
+        self._count = 0
+        self._last_change = datetime.min
+        self._next_refresh = 0.0
+        self._next_rebuild = 0.0
+        self._lock = threading.Lock()
+
+    def might_contain(self, email: str) -> bool:
+        """False only if the email was not registered when the filter was last synced."""
+        return self._filter is None or email in self._filter
+
+    def add(self, email: str) -> None:
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(email)
+                self._count += 1
+
+    def claim_rebuild(self) -> bool:
+        """True if a rebuild is due. Only one caller per interval gets True."""
+        now = self._clock()
+        with self._lock:
+            if now < self._next_rebuild:
+                return False
+            self._next_rebuild = now + self.rebuild_interval
+            self._next_refresh = now + self.refresh_interval
+            return True
+
+    def rebuild_failed(self) -> None:
+        """Let the rebuild be claimed again after `refresh_interval` seconds."""
+        with self._lock:
+            self._next_rebuild = self._clock() + self.refresh_interval
+
+    def claim_refresh(self) -> Optional[datetime]:
+        """Where an incremental refresh should read from if one is due, None otherwise."""
+        now = self._clock()
+        with self._lock:
+            if self._filter is None or now < self._next_refresh:
+                return None
+            self._next_refresh = now + self.refresh_interval
+            if self._last_change - datetime.min < self.lookback:
+                return datetime.min
+            return self._last_change - self.lookback
+
+    def rebuild(self, max_user_id: int, rows: Iterable[Tuple[str, datetime]]) -> None:
+        """Replace the filter with one holding exactly `rows`.
+
+        Args:
+            max_user_id (int): Highest user `id`, an upper bound on the user count.
+            rows (Iterable[Tuple[str, datetime]]): Email and `email_changed_at`
+                of every user.
+        """
+        # Leave room to grow so the error rate holds until the next rebuild.
+        bloom = BloomFilter(max(self.capacity, 2 * max_user_id), self.error_rate)
+        count = 0
+        last_change = datetime.min
+        for email, changed_at in rows:
+            bloom.add(email)
+            count += 1
+            last_change = max(last_change, changed_at)
+        with self._lock:
+            self._filter, self._count, self._last_change = bloom, count, last_change
+
+    def apply(self, rows: Iterable[Tuple[str, datetime]]) -> None:
+        for email, changed_at in rows:
+            self.add(email)
+            with self._lock:
+                self._last_change = max(self._last_change, changed_at)
+
+    def __len__(self) -> int:
+        return self._count
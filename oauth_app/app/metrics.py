@@ -0,0 +1,441 @@
+"""In-process metrics exposed in the Prometheus text format.
+
+Every metric and label set is created up front, at import or when the routes
+are known, so recording a value is a dict lookup, a bisect and an increment
+under a lock. Nothing is allocated per request on the hot path.
+"""
+import asyncio
+import functools
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        )
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class HistogramChild:
+    __slots__ = ("_buckets", "_counts", "_sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self._buckets = buckets
+        # One count per bucket plus the implicit +Inf bucket.
+        self._counts = [0] * (len(buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self._buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class Histogram:
+    """A histogram, optionally split by labels.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        label_names (Sequence[str]): Names of the labels, empty for no labels.
+        buckets (Sequence[float]): Upper bounds of the buckets, in seconds.
+        label_values (Iterable[Sequence[str]]): Label sets to create up front.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+        label_values: Iterable[Sequence[str]] = (),
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[Tuple[str, ...], HistogramChild] = {}
+        self._lock = threading.Lock()
+        if not self.label_names:
+            self._children[()] = HistogramChild(self.buckets)
+        for values in label_values:
+            self.labels(*values)
+
+    def labels(self, *values: str) -> HistogramChild:
+        """The child for a label set, created on first use."""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} expects labels {self.label_names}")
+            with self._lock:
+                child = self._children.setdefault(values, HistogramChild(self.buckets))
+        return child
+
+    def observe(self, value: float) -> None:
+        self._children[()].observe(value)
+
+    def collect(self) -> Iterable[str]:
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _format_labels(
+                    self.label_names + ("le",), values + (_format_value(bound),)
+                )
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.label_names, values)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CallbackMetric:
+    """A gauge or counter whose samples are read from `callback` at scrape time.
+
+    Suits values that are already tracked elsewhere, such as cache statistics.
+
+    Args:
+        callback (Callable[[], Iterable[Tuple[Sequence[str], float]]]): Returns
+            the label values and value of every sample.
+        kind (str): Either "gauge" or "counter".
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        label_names: Sequence[str],
+        callback: Callable[[], Iterable[Tuple[Sequence[str], float]]],
+        kind: str = "gauge",
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.callback = callback
+        self.kind = kind
+
+    def collect(self) -> Iterable[str]:
+        for values, value in self.callback():
+            labels = _format_labels(self.label_names, tuple(values))
+            yield f"{self.name}{labels} {_format_value(value)}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def register(self, metric: Any) -> Any:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Time to handle a request, by route template, method and status class.",
+        ("route", "method", "status"),
+    )
+)
+TOKEN_DECODE_SECONDS = registry.register(
+    Histogram(
+        "token_decode_duration_seconds",
+        "Time to decode an access token, split by whether the token cache had it.",
+        ("result",),
+        label_values=[("cache_hit",), ("verified",)],
+    )
+)
+PASSWORD_HASH_SECONDS = registry.register(
+    Histogram(
+        "password_hash_duration_seconds",
+        "Time from submitting a hashing job to its completion, queueing included.",
+        ("operation",),
+        buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+        label_values=[
+            (operation,)
+            for operation in (
+                "verify",
+                "verify_and_update",
+                "hash_password",
+                "hash_record_password",
+            )
+        ],
+    )
+)
+DB_QUERY_SECONDS = registry.register(
+    Histogram(
+        "db_query_duration_seconds",
+        "Time spent executing a database statement, by statement type.",
+        ("statement",),
+        label_values=[
+            (kind,) for kind in ("select", "insert", "update", "delete", "other")
+        ],
+    )
+)
+RESPONSE_BUILD_SECONDS = registry.register(
+    Histogram(
+        "response_build_duration_seconds",
+        "Time from an endpoint returning to its response being rendered, "
+        "response model validation and encoding included.",
+    )
+)
+
+STATEMENT_KINDS = {
+    kind: DB_QUERY_SECONDS.labels(kind)
+    for kind in ("select", "insert", "update", "delete")
+}
+OTHER_STATEMENTS = DB_QUERY_SECONDS.labels("other")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_start
+    kind = statement.lstrip()[:6].lower()
+    STATEMENT_KINDS.get(kind, OTHER_STATEMENTS).observe(elapsed)
+
+
+# When the endpoint of the current request returned, set by `TimedRoute`.
+_endpoint_returned: ContextVar[List[float]] = ContextVar("endpoint_returned")
+
+
+def _stamp_return(call: Callable[..., Any]) -> Callable[..., Any]:
+    # Endpoints returning a `Response` skip the response build, they are not stamped.
+    if asyncio.iscoroutinefunction(call):
+
+        @functools.wraps(call)
+        async def stamped(**values: Any) -> Any:
+            result = await call(**values)
+            if not isinstance(result, Response):
+                _endpoint_returned.get()[0] = time.perf_counter()
+            return result
+
+    else:
+
+        @functools.wraps(call)
+        def stamped(**values: Any) -> Any:
+            # Runs in the threadpool on a copy of the context, holding the same list.
+            result = call(**values)
+            if not isinstance(result, Response):
+                _endpoint_returned.get()[0] = time.perf_counter()
+            return result
+
+    return stamped
+
+
+class TimedRoute(APIRoute):
+    """Route recording `RESPONSE_BUILD_SECONDS` for the responses FastAPI builds.
+
+    The response build runs inside FastAPI's request handler, after the endpoint
+    returns: validating the result against the response model, `jsonable_encoder`
+    and rendering the body. So the endpoint stamps when it returned and the
+    handler observes the time from there until it has the response.
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Any]:
+        self.dependant.call = _stamp_return(self.dependant.call)
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request) -> Response:
+            returned = [0.0]
+            token = _endpoint_returned.set(returned)
+            try:
+                response = await handler(request)
+            finally:
+                _endpoint_returned.reset(token)
+            if returned[0]:
+                RESPONSE_BUILD_SECONDS.observe(time.perf_counter() - returned[0])
+            return response
+
+        return timed_handler
+
+
+STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+UNMATCHED_ROUTE = "<unmatched>"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording `REQUEST_SECONDS` for every HTTP request.
+
+    Routes are labelled by their path template, so `/users/1` and `/users/2`
+    share a series. The label sets of every route are created on the first
+    request, once all routes are registered.
+    """
+
+    def __init__(self, app: ASGIApp, routes: Optional[Callable[[], List[Any]]] = None):
+        self.app = app
+        self._routes = routes
+        self._children: Optional[Dict[Any, HistogramChild]] = None
+
+    def _build_children(self) -> Dict[Any, HistogramChild]:
+        children = {}
+        routes = self._routes() if self._routes is not None else []
+        for route in routes:
+            if not isinstance(route, Route):
+                continue
+            for method in route.methods or ():
+                for status in STATUS_CLASSES:
+                    child = REQUEST_SECONDS.labels(route.path, method, status)
+                    children[(route.endpoint, method, status)] = child
+        return children
+
+    def _child(self, scope: Scope, status_code: int) -> HistogramChild:
+        if self._children is None:
+            self._children = self._build_children()
+        status = STATUS_CLASSES[min(max(status_code // 100, 1), 5) - 1]
+        # The router stores the matched endpoint in the shared scope.
+        child = self._children.get((scope.get("endpoint"), scope["method"], status))
+        if child is None:
+            child = REQUEST_SECONDS.labels(UNMATCHED_ROUTE, scope["method"], status)
+        return child
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self._child(scope, status_code).observe(time.perf_counter() - start)
+
+
+def register_state_metrics(
+    caches: Dict[str, Any],
+    pool_stats: Callable[[], Dict[str, Dict[str, Any]]],
+    hashing_pool: Any,
+) -> None:
+    """Export cache, connection pool and hashing pool state, read at scrape time."""
+
+    def cache_stat(stat: str) -> Callable[[], Iterable[Tuple[Sequence[str], float]]]:
+        return lambda: [
+            ((name,), cache.stats()[stat]) for name, cache in caches.items()
+        ]
+
+    def pool_stat(stat: str) -> Callable[[], Iterable[Tuple[Sequence[str], float]]]:
+        return lambda: [((name,), stats[stat]) for name, stats in pool_stats().items()]
+
+    for stat, kind in [
+        ("size", "gauge"),
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+    ]:
+        suffix = "_total" if kind == "counter" else ""
+        registry.register(
+            CallbackMetric(
+                f"cache_{stat}{suffix}",
+                f"Cache {stat}.",
+                ("cache",),
+                cache_stat(stat),
+                kind,
+            )
+        )
+    for stat, kind in [
+        ("checked_out", "gauge"),
+        ("overflow", "gauge"),
+        ("checkouts", "counter"),
+        ("wait_seconds_total", "counter"),
+        ("timeouts", "counter"),
+    ]:
+        name = stat
+        if kind == "counter" and not stat.endswith("_total"):
+            name += "_total"
+        registry.register(
+            CallbackMetric(
+                f"db_pool_{name}",
+                f"Connection pool {stat.replace('_', ' ')}.",
+                ("engine",),
+                pool_stat(stat),
+                kind,
+            )
+        )
+    registry.register(
+        CallbackMetric(
+            "password_hash_in_flight",
+            "Hashing jobs running or waiting for a worker.",
+            (),
+            lambda: [((), hashing_pool.in_flight)],
+        )
+    )
+    registry.register(
+        CallbackMetric(
+            "password_hash_capacity",
+            "Hashing jobs admitted at once before requests are shed with a 503.",
+            (),
+            lambda: [((), hashing_pool.max_workers + hashing_pool.max_queue)],
+        )
+    )
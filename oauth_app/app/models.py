@@ -1,4 +1,13 @@
-from sqlalchemy import Boolean, Column, Integer, String
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    func,
+)
 
 from oauth_app.app.database.base_class import Base
 
@@ -12,3 +21,52 @@ class User(Base):
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
     is_superuser = Column(Boolean, default=False)
+    # Access tokens issued with an older generation are revoked.
+    token_generation = Column(Integer, nullable=False, default=0, server_default="0")
+    # Set whenever the email is set, lets workers pick up each other's new emails.
+    email_changed_at = Column(
+        DateTime, nullable=False, server_default=func.now(), index=True
+    )
+
+    __table_args__ = (
+        # Keyset pages of filtered listings walk these in `id` order.
+        Index("ix_users_is_active_id", "is_active", "id"),
+        Index("ix_users_is_superuser_id", "is_superuser", "id"),
+        # Lets `email LIKE 'prefix%'` use an index whatever the collation.
+        Index(
+            "ix_users_email_pattern",
+            "email",
+            postgresql_ops={"email": "text_pattern_ops"},
+        ),
+    )
+
+
+class RefreshToken(Base):
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True
+    )
+    # SHA-256 of the opaque token, the token itself is never stored.
+    token_hash = Column(String(64), unique=True, nullable=False)
+    # Every token rotated from the same login shares a family.
+    family_id = Column(String(32), nullable=False, index=True)
+    expires_at = Column(DateTime, nullable=False)
+    used_at = Column(DateTime, nullable=True)
+    revoked = Column(Boolean, nullable=False, default=False)
+
+
+class TokenRevocation(Base):
+    """A revoked access token (`jti`) or a user's revoked token generation."""
+
+    __tablename__ = "token_revocations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    jti = Column(String(32), nullable=True)
+    user_id = Column(
+        Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False
+    )
+    generation = Column(Integer, nullable=True)
+    # When the revoked tokens would have expired anyway and the row can be forgotten.
+    expires_at = Column(DateTime, nullable=True, index=True)
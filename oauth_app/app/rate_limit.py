@@ -0,0 +1,77 @@
+"""Login rate limiting with the generic cell rate algorithm (GCRA).
+
+GCRA keeps a single timestamp per key, the theoretical arrival time (TAT) of
+the next request, which makes it as precise as a sliding window while costing
+one float per client. A key whose TAT is in the past has its full burst back,
+so it carries no information and is evicted.
+
+The limiter class is chosen with `RATE_LIMIT_BACKEND`, a dotted path to a class
+taking `(limit, period)` with the async `check`, `hit` and `reset` methods of
+`MemoryRateLimiter`. The in-process default limits each worker separately, a
+shared backend makes the limits global across workers.
+"""
+import importlib
+import threading
+import time
+from typing import Dict
+
+
+class MemoryRateLimiter:
+    """Allow `limit` hits per key every `period` seconds, with bursts up to `limit`.
+
+    Args:
+        limit (int): Hits allowed per period.
+        period (float): Length of the period in seconds.
+        clock (Callable[[], float]): Monotonic clock.
+    """
+
+    def __init__(self, limit: int, period: float, clock=time.monotonic):
+        self.limit = limit
+        self.period = period
+        self._interval = period / limit
+        self._clock = clock
+        self._tats: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._next_eviction = clock() + period
+
+    def _retry_after(self, key: str, now: float) -> float:
+        tat = max(self._tats.get(key, now), now)
+        return max(tat + self._interval - self.period - now, 0.0)
+
+    async def check(self, key: str) -> float:
+        """Seconds until `key` may hit again, 0 if it may hit now. Consumes nothing."""
+        return self._retry_after(key, self._clock())
+
+    async def hit(self, key: str) -> float:
+        """Record a hit for `key` if allowed.
+
+        Returns:
+            float: 0 if the hit was allowed, otherwise the seconds to wait.
+        """
+        now = self._clock()
+        with self._lock:
+            if now >= self._next_eviction:
+                self._evict(now)
+            retry_after = self._retry_after(key, now)
+            if retry_after == 0:
+                self._tats[key] = max(self._tats.get(key, now), now) + self._interval
+            return retry_after
+
+    async def reset(self, key: str) -> None:
+        with self._lock:
+            self._tats.pop(key, None)
+
+    def _evict(self, now: float) -> None:
+        self._next_eviction = now + self.period
+        for key in [key for key, tat in self._tats.items() if tat <= now]:
+            del self._tats[key]
+
+    def __len__(self) -> int:
+        return len(self._tats)
+
+
+def load_rate_limiter(path: str, limit: int, period: float):
+    """Instantiate the rate limiter class at the dotted `path`."""
+    module_name, _, class_name = path.rpartition(".")
+    limiter_class = getattr(importlib.import_module(module_name), class_name)
+    return limiter_class(limit, period)
@@ -0,0 +1,113 @@
+import time
+import threading
+from datetime import timezone
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from oauth_app.app import crud_async
+from oauth_app.app import models
+
+
+class RevocationIndex:
+    """In-process copy of the `token_revocations` table.
+
+    Revoked token ids live in a dict and revoked generations in a per-user dict,
+    so checking a token that is not revoked costs two hash lookups. The index is
+    refreshed incrementally by fetching the rows added since the last refresh,
+    which also picks up revocations made by other workers. Each refresh reads
+    `lookback` rows further back than the highest `id` seen, so a row whose
+    transaction committed after a higher `id` was read is not skipped.
+    Entries are dropped once the tokens they revoke have expired.
+
+    Args:
+        refresh_interval (float): Seconds between refreshes from the database.
+        lookback (int): Rows below the highest `id` seen that each refresh re-reads.
+        clock (Callable[[], float]): Wall clock, token `exp` claims are timestamps.
+    """
+
+    def __init__(self, refresh_interval: float, lookback: int = 1000, clock=time.time):
+        self.refresh_interval = refresh_interval
+        self.lookback = lookback
+        self._clock = clock
+        self._jtis: Dict[str, float] = {}
+        # Revoked generation and when the last token it revokes expires, per user.
+        self._generations: Dict[int, Tuple[int, float]] = {}
+        self._last_id = 0
+        self._next_refresh = 0.0
+        self._lock = threading.Lock()
+
+    def is_revoked(self, payload: Dict[str, Any]) -> bool:
+        if payload.get("jti") in self._jtis:
+            return True
+        revoked = self._generations.get(payload.get("uid"))
+        return revoked is not None and payload.get("gen", 0) < revoked[0]
+
+    def revoke(self, jti: str, expires_at: float) -> None:
+        self._jtis[jti] = expires_at
+
+    def revoke_generation(
+        self, user_id: int, generation: int, expires_at: float = float("inf")
+    ) -> None:
+        with self._lock:
+            current = self._generations.get(user_id)
+            if current is None or generation > current[0]:
+                self._generations[user_id] = (generation, expires_at)
+            elif generation == current[0]:
+                self._generations[user_id] = (generation, max(expires_at, current[1]))
+
+    def claim_refresh(self) -> Optional[int]:
+        """Return the row id to read past if a refresh is due, None otherwise.
+
+        Only one caller gets to refresh per interval, the others keep using the
+        current index instead of piling onto the database.
+        """
+        now = self._clock()
+        with self._lock:
+            if now < self._next_refresh:
+                return None
+            self._next_refresh = now + self.refresh_interval
+            return max(self._last_id - self.lookback, 0)
+
+    def apply(self, rows: Iterable[models.TokenRevocation]) -> None:
+        """Add the revocations in `rows`, rows already applied are harmless."""
+        now = self._clock()
+        for row in rows:
+            if row.expires_at is None:
+                expires_at = float("inf")
+            else:
+                expires_at = row.expires_at.replace(tzinfo=timezone.utc).timestamp()
+            if expires_at > now:
+                if row.jti is not None:
+                    self._jtis[row.jti] = expires_at
+                if row.generation is not None:
+                    self.revoke_generation(row.user_id, row.generation, expires_at)
+            self._last_id = max(self._last_id, row.id)
+        self.prune(now)
+
+    def prune(self, now: float) -> None:
+        """Forget the revocations whose tokens have all expired by `now`.
+
+        Expired tokens fail verification anyway.
+        """
+        expired = [jti for jti, expires_at in self._jtis.items() if expires_at <= now]
+        for jti in expired:
+            self._jtis.pop(jti, None)
+        with self._lock:
+            expired = [
+                user_id
+                for user_id, (_, expires_at) in self._generations.items()
+                if expires_at <= now
+            ]
+            for user_id in expired:
+                del self._generations[user_id]
+
+    def __len__(self) -> int:
+        return len(self._jtis) + len(self._generations)
+
+
+async def refresh_revocations(
+    db: crud_async.AnySession, index: RevocationIndex
+) -> None:
+    """Load the revocations added since the last refresh of `index`, if one is due."""
+    after_id = index.claim_refresh()
+    if after_id is not None:
+        index.apply(await crud_async.get_token_revocations(db, after_id))
@@ -1,6 +1,9 @@
-from typing import Optional
+import re
+from typing import List, Optional
 
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, constr, root_validator, validator
+
+BCRYPT_HASH_RE = re.compile(r"^\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}$")
 
 
 class UserBase(BaseModel):
@@ -14,11 +17,96 @@ class UserCreate(UserBase):
     password: str
 
 
+class UserImport(UserBase):
+    password: Optional[str] = None
+    # Accepted as is, so users keep their existing password.
+    hashed_password: Optional[str] = None
+
+    @root_validator(skip_on_failure=True)
+    def check_password(cls, values):
+        password = values.get("password")
+        hashed_password = values.get("hashed_password")
+        if (password is None) == (hashed_password is None):
+            raise ValueError("Exactly one of password or hashed_password is required")
+        if hashed_password is not None and not BCRYPT_HASH_RE.match(hashed_password):
+            raise ValueError("hashed_password must be a bcrypt hash")
+        return values
+
+
+class UserImportError(BaseModel):
+    line: int
+    error: str
+
+
+class UserImportResult(BaseModel):
+    created: int = 0
+    errors: List[UserImportError] = []
+
+
 class UserUpdate(UserBase):
     email: Optional[EmailStr] = None
     password: Optional[str] = None
 
 
+class UserFilter(BaseModel):
+    is_active: Optional[bool] = None
+    is_superuser: Optional[bool] = None
+    # An empty prefix would match every user.
+    email_prefix: Optional[constr(strip_whitespace=True, min_length=1)] = None
+
+
+class UserPatch(BaseModel):
+    full_name: Optional[str] = None
+    is_active: Optional[bool] = None
+    is_superuser: Optional[bool] = None
+
+    @validator("is_active", "is_superuser", pre=True)
+    def check_not_null(cls, v):
+        # Only omitted fields are left alone, users must have both flags.
+        if v is None:
+            raise ValueError("must be true or false")
+        return v
+
+
+class UserBulkUpdate(BaseModel):
+    """A patch applied to every user in `ids`, or to every user matching `filter`."""
+
+    ids: Optional[List[int]] = None
+    filter: Optional[UserFilter] = None
+    patch: UserPatch
+
+    @root_validator(skip_on_failure=True)
+    def check_target(cls, values):
+        if (values.get("ids") is None) == (values.get("filter") is None):
+            raise ValueError("Exactly one of ids or filter is required")
+        user_filter = values.get("filter")
+        if user_filter is not None and not user_filter.dict(exclude_none=True):
+            raise ValueError("filter must have at least one condition")
+        if not values["patch"].dict(exclude_unset=True):
+            raise ValueError("patch must set at least one field")
+        return values
+
+
+class UserBulkUpdateResult(BaseModel):
+    updated: int
+
+
+class UserFields(BaseModel):
+    """A user with only the requested fields set."""
+
+    id: Optional[int] = None
+    email: Optional[EmailStr] = None
+    full_name: Optional[str] = None
+    is_active: Optional[bool] = None
+    is_superuser: Optional[bool] = None
+
+
+class UserPage(BaseModel):
+    items: List[UserFields]
+    # Pass as `after` to get the next page, None on the last page.
+    next_after: Optional[int] = None
+
+
 class UserInDBBase(UserBase):
     id: Optional[int] = None
 
@@ -31,6 +119,11 @@ class User(UserInDBBase):
     pass
 
 
+# Authenticated user along with what is needed to issue its tokens
+class Principal(User):
+    token_generation: int = 0
+
+
 # Additional properties stored in DB
 class UserInDB(UserInDBBase):
     hashed_password: str
@@ -39,6 +132,7 @@ class UserInDB(UserInDBBase):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
 
 
 class TokenData(BaseModel):
@@ -1,16 +1,21 @@
-import os
-from typing import Union, Optional
-from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import logging
+import secrets
+from typing import Set, Union, Optional
+from datetime import datetime
 
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
+from starlette.concurrency import run_in_threadpool
 from pydantic import EmailStr
-from jose import jwt
 
 from oauth_app.app import crud
+from oauth_app.app import crud_async
 from oauth_app.app import models
+from oauth_app.app import hashing
+from oauth_app.app import services
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+logger = logging.getLogger(__name__)
 
 
 def fake_decode_token(db: Session, token: str) -> Union[models.User, None]:
@@ -22,31 +27,128 @@ def fake_hash_password(password: str) -> str:
     return "fakehashed" + password
 
 
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
+def verify_password(db: Session, plain_password: str, hashed_password: str):
+    hasher = services.services_of(db).hasher
+    return hasher.run(hashing.verify, hasher.policy, plain_password, hashed_password)
 
 
-def get_password_hash(password) -> str:
-    return pwd_context.hash(password)
+def get_password_hash(db: Session, password) -> str:
+    hasher = services.services_of(db).hasher
+    return hasher.run(hashing.hash_password, hasher.policy, password)
 
 
 def authenticate_user(db: Session, email: EmailStr, password: str):
+    hasher = services.services_of(db).hasher
     user = crud.get_user_by_email(db, email=email)
     if not user:
+        hasher.run(
+            hashing.verify, hasher.policy, password, hashing.dummy_hash(hasher.policy)
+        )
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = hasher.run(
+        hashing.verify_and_update, hasher.policy, password, user.hashed_password
+    )
+    if not verified:
         return False
+    if new_hash is not None:
+        # The hash predates the current hashing policy, upgrade it while we have the password.
+        crud.update_password_hash(db, user, new_hash)
     return user
 
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    secret_key = os.environ["SECRET_KEY"]
-    algorithm = os.environ["ALGORITHM"]
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+async def authenticate_user_async(
+    db: "crud_async.AnySession", email: EmailStr, password: str
+):
+    """Same as `authenticate_user` but never blocks the event loop.
+
+    Emails missing from the known email filter are rejected without a query.
+    """
+    hasher = services.services_of(db).hasher
+    user = None
+    if await email_may_exist(db, email):
+        user = await crud_async.get_user_by_email(db, email)
+    if not user:
+        await hasher.run_async(
+            hashing.verify, hasher.policy, password, hashing.dummy_hash(hasher.policy)
+        )
+        return False
+    verified, new_hash = await hasher.run_async(
+        hashing.verify_and_update, hasher.policy, password, user.hashed_password
+    )
+    if not verified:
+        return False
+    if new_hash is not None:
+        await crud_async.update_password_hash(db, user, new_hash)
+    return user
+
+
+def _sync_known_emails(db: Session, changed_since: Optional[datetime]) -> None:
+    known_emails = services.services_of(db).known_emails
+    if changed_since is None:
+        known_emails.rebuild(crud.get_max_user_id(db), crud.iter_user_emails(db))
     else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, secret_key, algorithm=algorithm)
-    return encoded_jwt
+        known_emails.apply(crud.iter_user_emails(db, changed_since))
+
+
+def rebuild_known_emails(context: "services.Services") -> None:
+    """Rebuild the known email filter of `context` from the database, blocking."""
+    db = context.database.session_factory()
+    try:
+        _sync_known_emails(db, None)
+    except Exception:
+        context.known_emails.rebuild_failed()
+        raise
+    finally:
+        db.close()
+
+
+# Keeps the background rebuilds referenced until they finish.
+_rebuilds: Set["asyncio.Future[None]"] = set()
+
+
+def _rebuild_done(future: "asyncio.Future[None]") -> None:
+    _rebuilds.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        logger.warning(
+            "Could not rebuild the known email filter", exc_info=future.exception()
+        )
+
+
+def _rebuild_in_background(context: "services.Services") -> None:
+    future = asyncio.ensure_future(run_in_threadpool(rebuild_known_emails, context))
+    _rebuilds.add(future)
+    future.add_done_callback(_rebuild_done)
+
+
+async def email_may_exist(db: "crud_async.AnySession", email: str) -> bool:
+    """False if `email` is certainly not registered, checked without a user query.
+
+    A miss syncs the filter with the emails set since the last sync first, at
+    most every `EMAIL_FILTER_REFRESH_SECONDS`, so users just created or renamed
+    by another worker are not turned away. A miss between syncs may be such a
+    user, so it is looked up. Due full rebuilds run in the background, the
+    request keeps using the current filter.
+    """
+    context = services.services_of(db)
+    if not context.settings.EMAIL_FILTER_ENABLED:
+        return True
+    known_emails = context.known_emails
+    if known_emails.claim_rebuild():
+        _rebuild_in_background(context)
+    if known_emails.might_contain(email):
+        return True
+    changed_since = known_emails.claim_refresh()
+    if changed_since is None:
+        # The filter may be missing emails set since its last sync.
+        return True
+    await crud_async.run(db, _sync_known_emails, changed_since)
+    return known_emails.might_contain(email)
+
+
+def generate_refresh_token() -> str:
+    return secrets.token_urlsafe(32)
+
+
+def hash_refresh_token(token: str) -> str:
+    """Refresh tokens are random and high entropy, a fast hash is enough."""
+    return hashlib.sha256(token.encode()).hexdigest()
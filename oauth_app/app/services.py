@@ -0,0 +1,162 @@
+"""The stateful components of an app instance, wired together in one place.
+
+`create_app` hands a `Services` to the app, endpoints get it from the request
+and the query layer from the session, whose `info` carries the `Services` that
+made it. Two apps with their own `Services` share no engines, pools or caches,
+such as the apps of two tenants served by one process. Sessions that were not
+made by a `Services`, as in scripts, use the default one, built from the
+environment.
+
+Only the metrics registry is process-wide.
+"""
+import threading
+from typing import TYPE_CHECKING, Any, Optional
+
+from oauth_app.app.config import Settings
+
+if TYPE_CHECKING:
+    from oauth_app.app.cache import TTLCache
+    from oauth_app.app.database.session import Database
+    from oauth_app.app.hashing import PasswordHashingPool
+    from oauth_app.app.known_emails import KnownEmails
+    from oauth_app.app.revocation import RevocationIndex
+    from oauth_app.app.tokens import TokenService
+
+
+class Services:
+    """Database, hashing pool, token service, caches and rate limiters of an app.
+
+    Args:
+        settings (Settings): Settings the components were built from.
+        database (Database): Engines and session factories.
+        hasher (PasswordHashingPool): Runs password hashing off the event loop.
+        tokens (TokenService): Issues and verifies access tokens.
+        principal_cache (TTLCache): Authenticated principals keyed by email.
+        known_emails (KnownEmails): Filter of the registered emails.
+        revocation_index (RevocationIndex): Revoked tokens and token generations.
+        login_ip_limiter: Limits login attempts per client IP.
+        login_account_limiter: Limits failed login attempts per account.
+    """
+
+    def __init__(
+        self,
+        *,
+        settings: Settings,
+        database: "Database",
+        hasher: "PasswordHashingPool",
+        tokens: "TokenService",
+        principal_cache: "TTLCache",
+        known_emails: "KnownEmails",
+        revocation_index: "RevocationIndex",
+        login_ip_limiter: Any,
+        login_account_limiter: Any,
+    ):
+        self.settings = settings
+        self.database = database
+        self.hasher = hasher
+        self.tokens = tokens
+        self.principal_cache = principal_cache
+        self.known_emails = known_emails
+        self.revocation_index = revocation_index
+        self.login_ip_limiter = login_ip_limiter
+        self.login_account_limiter = login_account_limiter
+        # Lets the query layer find these services from any session of the database.
+        database.session_info["services"] = self
+
+    @property
+    def token_cache(self) -> "TTLCache":
+        return self.tokens.cache
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "Services":
+        """Build every component anew, sharing no state with other instances."""
+        from oauth_app.app.cache import TTLCache
+        from oauth_app.app.database.session import Database
+        from oauth_app.app.hashing import PasswordHashingPool
+        from oauth_app.app.keys import KeyRing
+        from oauth_app.app.known_emails import KnownEmails
+        from oauth_app.app.rate_limit import load_rate_limiter
+        from oauth_app.app.revocation import RevocationIndex
+        from oauth_app.app.tokens import TokenService
+
+        token_cache = TTLCache(
+            maxsize=settings.TOKEN_CACHE_SIZE, ttl=settings.TOKEN_CACHE_TTL
+        )
+        return cls(
+            settings=settings,
+            database=Database(settings),
+            hasher=PasswordHashingPool(
+                settings,
+                kind=settings.PASSWORD_HASH_EXECUTOR,
+                max_workers=settings.PASSWORD_HASH_WORKERS,
+                max_queue=settings.PASSWORD_HASH_MAX_QUEUE,
+            ),
+            tokens=TokenService(settings, KeyRing.from_settings(settings), token_cache),
+            principal_cache=TTLCache(
+                maxsize=settings.PRINCIPAL_CACHE_SIZE, ttl=settings.PRINCIPAL_CACHE_TTL
+            ),
+            known_emails=KnownEmails(
+                capacity=settings.EMAIL_FILTER_CAPACITY,
+                error_rate=settings.EMAIL_FILTER_ERROR_RATE,
+                refresh_interval=settings.EMAIL_FILTER_REFRESH_SECONDS,
+                rebuild_interval=settings.EMAIL_FILTER_REBUILD_SECONDS,
+                lookback=settings.EMAIL_FILTER_LOOKBACK_SECONDS,
+            ),
+            revocation_index=RevocationIndex(
+                refresh_interval=settings.REVOCATION_REFRESH_SECONDS,
+                lookback=settings.REVOCATION_LOOKBACK_ROWS,
+            ),
+            login_ip_limiter=load_rate_limiter(
+                settings.RATE_LIMIT_BACKEND,
+                settings.LOGIN_IP_LIMIT,
+                settings.LOGIN_IP_PERIOD,
+            ),
+            login_account_limiter=load_rate_limiter(
+                settings.RATE_LIMIT_BACKEND,
+                settings.LOGIN_ACCOUNT_LIMIT,
+                settings.LOGIN_ACCOUNT_PERIOD,
+            ),
+        )
+
+    async def startup(self) -> None:
+        """Open the first database connections and build the known email filter.
+
+        The first requests then wait for neither, see `Database.warm_up`.
+        """
+        from starlette.concurrency import run_in_threadpool
+
+        from oauth_app.app.security import rebuild_known_emails
+
+        connections = self.settings.DB_POOL_WARMUP
+        if self.database.asynchronous:
+            await self.database.warm_up_async(connections)
+        else:
+            await run_in_threadpool(self.database.warm_up, connections)
+        if self.settings.EMAIL_FILTER_ENABLED and self.known_emails.claim_rebuild():
+            await run_in_threadpool(rebuild_known_emails, self)
+
+    async def shutdown(self) -> None:
+        self.hasher.shutdown()
+        await self.database.dispose_async()
+
+
+_default: Optional[Services] = None
+_default_lock = threading.Lock()
+
+
+def get_default_services() -> Services:
+    """The services of the default app, built from the environment on first use."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                from oauth_app.app import config
+
+                _default = Services.from_settings(config.settings)
+    return _default
+
+
+def services_of(db: Any) -> Services:
+    """The services that made the session `db`, sync or asyncio."""
+    services = getattr(db, "sync_session", db).info.get("services")
+    return services or get_default_services()
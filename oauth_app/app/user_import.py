@@ -0,0 +1,252 @@
+"""Bulk user import from NDJSON or CSV.
+
+Records are parsed one line at a time and written in batches, so an import of
+any size only ever holds one batch in memory. The passwords of a batch are
+hashed in parallel on the hashing pool and the batch is inserted with a single
+multi-row `INSERT ... ON CONFLICT DO NOTHING RETURNING`. Invalid or already
+registered records are reported by line number and never abort the import.
+"""
+import codecs
+import csv
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
+
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from oauth_app.app import crud
+from oauth_app.app import crud_async
+from oauth_app.app import schemas
+from oauth_app.app.hashing import hash_password
+from oauth_app.app.services import services_of
+
+FORMATS = ("ndjson", "csv")
+
+Record = Tuple[int, Union[schemas.UserImport, str]]
+
+
+class RecordParser:
+    """Turn input lines into validated records, keeping the CSV header between calls.
+
+    Each record must fit on one line, CSV fields with embedded newlines are not
+    supported.
+
+    Args:
+        format (str): Either `ndjson` or `csv`, whose first line is the header.
+    """
+
+    def __init__(self, format: str):
+        if format not in FORMATS:
+            raise ValueError(f"Unsupported import format: {format}")
+        self.format = format
+        self._header: Optional[List[str]] = None
+        self._line = 0
+
+    def parse(self, line: str) -> Optional[Record]:
+        """Parse one line, None for blank lines and the CSV header."""
+        self._line += 1
+        if not line.strip():
+            return None
+        try:
+            data = self._decode(line)
+        except ValueError as e:
+            return self._line, str(e)
+        if data is None:
+            return None
+        try:
+            return self._line, schemas.UserImport.parse_obj(data)
+        except ValidationError as e:
+            return self._line, "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                for error in e.errors()
+            )
+
+    def _decode(self, line: str) -> Optional[Dict[str, Any]]:
+        if self.format == "ndjson":
+            data = json.loads(line)
+            if not isinstance(data, dict):
+                raise ValueError("Expected a JSON object")
+            return data
+        (values,) = csv.reader([line])
+        if self._header is None:
+            self._header = [name.strip() for name in values]
+            return None
+        if len(values) != len(self._header):
+            raise ValueError(f"Expected {len(self._header)} fields, got {len(values)}")
+        # Empty CSV fields mean "use the default".
+        return {name: value for name, value in zip(self._header, values) if value != ""}
+
+
+# A password's hash, or why it could not be hashed.
+HashResult = Tuple[Optional[str], Optional[str]]
+
+
+def hash_record_password(policy: str, password: str) -> HashResult:
+    """Hash one record's password, so a password the hasher rejects fails one record.
+
+    Module level, so process pools can pickle it.
+    """
+    try:
+        return hash_password(policy, password), None
+    except ValueError as e:
+        # passlib rejects some passwords, such as ones with NUL bytes.
+        return None, f"password: {e}"
+
+
+def prepare_batch(
+    records: List[Record], hashed_passwords: List[HashResult]
+) -> Tuple[List[Dict[str, Any]], List[int], List[schemas.UserImportError]]:
+    """Build the rows to insert from a batch of parsed records.
+
+    Args:
+        records (List[Record]): Parsed records, in input order.
+        hashed_passwords (List[HashResult]): Results of hashing the plain
+            passwords in `records`, in the same order.
+
+    Returns:
+        Tuple: The rows, the line number of each row and the errors of the batch.
+    """
+    rows: List[Dict[str, Any]] = []
+    lines: List[int] = []
+    errors: List[schemas.UserImportError] = []
+    seen = set()
+    hashes = iter(hashed_passwords)
+    for line, record in records:
+        if isinstance(record, str):
+            errors.append(schemas.UserImportError(line=line, error=record))
+            continue
+        hashed_password = record.hashed_password
+        if hashed_password is None:
+            hashed_password, error = next(hashes)
+            if error is not None:
+                errors.append(schemas.UserImportError(line=line, error=error))
+                continue
+        if record.email in seen:
+            errors.append(
+                schemas.UserImportError(line=line, error="Duplicate email in import")
+            )
+            continue
+        seen.add(record.email)
+        rows.append(
+            {
+                "email": record.email,
+                "full_name": record.full_name,
+                "hashed_password": hashed_password,
+                "is_active": record.is_active,
+                "is_superuser": record.is_superuser,
+            }
+        )
+        lines.append(line)
+    return rows, lines, errors
+
+
+def passwords_to_hash(records: List[Record]) -> List[str]:
+    return [
+        record.password
+        for _, record in records
+        if not isinstance(record, str) and record.hashed_password is None
+    ]
+
+
+def record_batch(
+    result: schemas.UserImportResult,
+    rows: List[Dict[str, Any]],
+    lines: List[int],
+    errors: List[schemas.UserImportError],
+    created: Iterable[str],
+) -> None:
+    created = set(created)
+    for row, line in zip(rows, lines):
+        if row["email"] in created:
+            result.created += 1
+        else:
+            errors.append(
+                schemas.UserImportError(line=line, error="Email already registered")
+            )
+    result.errors.extend(sorted(errors, key=lambda error: error.line))
+
+
+def import_users(
+    db: Session, lines: Iterable[str], format: str, batch_size: int
+) -> schemas.UserImportResult:
+    """Import users from an iterable of lines, such as an open file.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    parser = RecordParser(format)
+    result = schemas.UserImportResult()
+    hasher = services_of(db).hasher
+
+    def flush(records: List[Record]) -> None:
+        hashed_passwords = hasher.map(
+            hash_record_password, passwords_to_hash(records), hasher.policy
+        )
+        rows, row_lines, errors = prepare_batch(records, hashed_passwords)
+        record_batch(result, rows, row_lines, errors, crud.bulk_create_users(db, rows))
+
+    batch: List[Record] = []
+    for line in lines:
+        record = parser.parse(line)
+        if record is not None:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return result
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Split a stream of UTF-8 bytes into lines without buffering the whole body."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+async def import_users_async(
+    db: crud_async.AnySession,
+    lines: AsyncIterator[str],
+    format: str,
+    batch_size: int,
+) -> schemas.UserImportResult:
+    """Async variant of `import_users`, for request bodies.
+
+    The blocking `PasswordHashingPool.map` runs in the threadpool, so the event loop keeps
+    serving other requests while a batch is hashed.
+
+    Raises:
+        ValueError: If the format is not supported.
+    """
+    parser = RecordParser(format)
+    result = schemas.UserImportResult()
+    hasher = services_of(db).hasher
+
+    async def flush(records: List[Record]) -> None:
+        hashed_passwords = await run_in_threadpool(
+            hasher.map, hash_record_password, passwords_to_hash(records), hasher.policy
+        )
+        rows, row_lines, errors = prepare_batch(records, hashed_passwords)
+        created = await crud_async.bulk_create_users(db, rows)
+        record_batch(result, rows, row_lines, errors, created)
+
+    batch: List[Record] = []
+    async for line in lines:
+        record = parser.parse(line)
+        if record is not None:
+            batch.append(record)
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+    return result
@@ -1,47 +1,236 @@
-import os
-from typing import Any
-from datetime import timedelta
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Any, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, status
+from fastapi import (
+    APIRouter,
+    Depends,
+    FastAPI,
+    Form,
+    HTTPException,
+    Query,
+    Request,
+    status,
+)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from oauth_app.app import models
 from oauth_app.app import schemas
-from oauth_app.app import crud
+from oauth_app.app import crud_async
+from oauth_app.app import metrics
 from oauth_app.app import security
+from oauth_app.app import user_export
+from oauth_app.app import user_import
+from oauth_app.app.config import Settings
+from oauth_app.app.crud_async import AnySession
+from oauth_app.app.hashing import HashingPoolSaturated
+from oauth_app.app.services import Services, get_default_services
 from oauth_app.app.deps import (
     get_db,
     get_current_active_superuser,
     get_current_active_user,
+    get_services,
+    oauth2_scheme,
 )
 
+logger = logging.getLogger(__name__)
+
+router = APIRouter(route_class=metrics.TimedRoute)
+
+
+async def hashing_pool_saturated_handler(request: Request, exc: HashingPoolSaturated):
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server is busy, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
 
-app = FastAPI()
+def create_app(
+    settings: Optional[Settings] = None, services: Optional[Services] = None
+) -> FastAPI:
+    """Build an app instance around its own engines, pools and caches.
 
+    Apps built from different settings share none of them, so one process can
+    serve several, for example one per tenant database.
+
+    Args:
+        settings (Optional[Settings]): Build new services from these settings.
+        services (Optional[Services]): Services to use, takes precedence over
+            `settings`. Without either the app uses the default services,
+            configured from the environment.
+    """
+    if services is None:
+        if settings is None:
+            services = get_default_services()
+        else:
+            services = Services.from_settings(settings)
 
-@app.get("/")
+    app = FastAPI()
+    app.state.services = services
+    app.add_middleware(metrics.MetricsMiddleware, routes=lambda: app.routes)
+    app.add_exception_handler(HashingPoolSaturated, hashing_pool_saturated_handler)
+
+    async def startup():
+        try:
+            await services.startup()
+        except Exception:
+            # Requests retry the connection, the worker should still come up.
+            logger.warning(
+                "Could not warm up the database pools or the known email filter",
+                exc_info=True,
+            )
+
+    async def shutdown():
+        await services.shutdown()
+
+    # On the app, not the shared router, which every app includes.
+    app.add_event_handler("startup", startup)
+    app.add_event_handler("shutdown", shutdown)
+    app.include_router(router)
+    return app
+
+
+@router.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
-@app.post("/users", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud.get_user_by_email(db, email=user.email)
-    if db_user:
+@router.post("/users", response_model=schemas.User)
+async def create_user(user: schemas.UserCreate, db: AnySession = Depends(get_db)):
+    db_user = await crud_async.create_user(db=db, user=user)
+    if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Email already registered"
         )
-    return crud.create_user(db=db, user=user)
+    return db_user
+
+
+USER_FIELDS = tuple(schemas.UserFields.__fields__)
 
 
-@app.put("/users/{user_id}", response_model=schemas.User)
-def update_user(
+@router.get(
+    "/users", response_model=schemas.UserPage, response_model_exclude_unset=True
+)
+async def list_users(
+    filters: schemas.UserFilter = Depends(),
+    after: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    fields: Optional[str] = Query(
+        None, description="Comma separated fields to return, `id` is always returned."
+    ),
+    db: AnySession = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_superuser),
+) -> Any:
+    """
+    Allows a superuser to page through users in `id` order.
+    """
+    selected = USER_FIELDS
+    if fields:
+        selected = tuple(field.strip() for field in fields.split(","))
+        unknown = set(selected) - set(USER_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}",
+            )
+    # One extra row tells whether there is a next page.
+    rows = await crud_async.list_users(
+        db, filters=filters, fields=selected, after=after, limit=limit + 1
+    )
+    next_after = rows[limit - 1].id if len(rows) > limit else None
+    return schemas.UserPage(
+        items=[schemas.UserFields(**row._mapping) for row in rows[:limit]],
+        next_after=next_after,
+    )
+
+
+@router.get("/users/export")
+async def export_users(
+    format: str = Query("ndjson", regex="^(ndjson|csv)$"),
+    current_user: models.User = Depends(get_current_active_superuser),
+    services: Services = Depends(get_services),
+) -> Any:
+    """
+    Allows a superuser to download every user as NDJSON or CSV.
+    """
+    batch_size = services.settings.USER_EXPORT_BATCH_SIZE
+    database = services.database
+    if database.asynchronous:
+        content = user_export.export_users_async(
+            format, batch_size, database.async_session_factory
+        )
+    else:
+        content = user_export.export_users(format, batch_size, database.session_factory)
+    return StreamingResponse(
+        content,
+        media_type=user_export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="users.{format}"'},
+    )
+
+
+IMPORT_CONTENT_TYPES = {
+    "application/x-ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json": "ndjson",
+    "text/csv": "csv",
+}
+
+
+@router.post("/users:bulk", response_model=schemas.UserImportResult)
+async def import_users(
+    request: Request,
+    db: AnySession = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_superuser),
+    services: Services = Depends(get_services),
+) -> Any:
+    """
+    Allows a superuser to create many users from an NDJSON or CSV request body.
+    """
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    format = IMPORT_CONTENT_TYPES.get(content_type)
+    if format is None:
+        raise HTTPException(
+            status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+            detail="Expected an application/x-ndjson or text/csv body",
+        )
+    return await user_import.import_users_async(
+        db,
+        user_import.iter_lines(request.stream()),
+        format,
+        services.settings.USER_IMPORT_BATCH_SIZE,
+    )
+
+
+@router.patch("/users:bulk", response_model=schemas.UserBulkUpdateResult)
+async def bulk_update_users(
     *,
-    db: Session = Depends(get_db),
+    db: AnySession = Depends(get_db),
+    update_in: schemas.UserBulkUpdate,
+    current_user: models.User = Depends(get_current_active_superuser),
+) -> Any:
+    """
+    Allows a superuser to update many users at once, such as to deactivate them.
+    """
+    updated = await crud_async.bulk_update_users(
+        db,
+        values=update_in.patch.dict(exclude_unset=True),
+        ids=update_in.ids,
+        filters=update_in.filter,
+    )
+    return {"updated": updated}
+
+
+@router.put("/users/{user_id}", response_model=schemas.User)
+async def update_user(
+    *,
+    db: AnySession = Depends(get_db),
     user_id: int,
     user_in: schemas.UserUpdate,
     current_user: models.User = Depends(get_current_active_superuser),
@@ -49,38 +238,148 @@ def update_user(
     """
     Allows a superuser to modify any part of the user.
     """
-    user = crud.get_user(db, user_id)
+    user = await crud_async.get_user(db, user_id)
     if not user:
         raise HTTPException(
             status_code=404,
             detail="The user with this username does not exist in the system",
         )
-    user = crud.update_user(db, db_obj=user, obj_in=user_in)
+    user = await crud_async.update_user(db, db_obj=user, obj_in=user_in)
     return user
 
 
-@app.post("/token")
+@router.post("/users/{user_id}/revoke-tokens")
+async def revoke_all_user_tokens(
+    *,
+    db: AnySession = Depends(get_db),
+    user_id: int,
+    current_user: models.User = Depends(get_current_active_superuser),
+    services: Services = Depends(get_services),
+) -> Any:
+    """
+    Allows a superuser to revoke every access and refresh token issued to a user.
+    """
+    generation = await revoke_user_tokens(db, user_id, services)
+    if generation is None:
+        raise HTTPException(
+            status_code=404,
+            detail="The user with this username does not exist in the system",
+        )
+    return {"token_generation": generation}
+
+
+async def revoke_user_tokens(
+    db: AnySession, user_id: int, services: Services
+) -> Optional[int]:
+    generation = await crud_async.revoke_user_tokens(db, user_id)
+    if generation is not None:
+        # Apply locally right away, other workers pick it up on their next refresh.
+        expires_at = (
+            time.time() + services.settings.access_token_expires.total_seconds()
+        )
+        services.revocation_index.revoke_generation(user_id, generation, expires_at)
+    return generation
+
+
+def too_many_attempts(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail="Too many login attempts",
+        headers={"Retry-After": str(math.ceil(retry_after))},
+    )
+
+
+@router.post("/token")
 async def login(
-    form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)
+    request: Request,
+    form_data: OAuth2PasswordRequestForm = Depends(),
+    db: AnySession = Depends(get_db),
+    services: Services = Depends(get_services),
 ):
     email = form_data.username
     password = form_data.password
-    access_token_expire_minutes = int(os.environ["ACCESS_TOKEN_EXPIRE_MINUTES"])
-    user = security.authenticate_user(db, email, password)
+    # Limits are checked before the user lookup and the password hash, so
+    # rejected attempts cost neither a query nor a hash.
+    retry_after = await services.login_ip_limiter.hit(request.client.host)
+    if retry_after:
+        raise too_many_attempts(retry_after)
+    # Every attempt takes an account slot before the hash, so concurrent guesses
+    # can not all get past the limit, a successful login gives them back.
+    account = email.lower()
+    retry_after = await services.login_account_limiter.hit(account)
+    if retry_after:
+        raise too_many_attempts(retry_after)
+    user = await security.authenticate_user_async(db, email, password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=access_token_expire_minutes)
-    access_token = security.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
-    )
-    return {"access_token": access_token, "token_type": "bearer"}
+    await services.login_account_limiter.reset(account)
+    access_token = services.tokens.create_user_access_token(user)
+    refresh_token = await crud_async.create_refresh_token(db, user.id)
+    return {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_type": "bearer",
+    }
 
 
-@app.get("/users/me", response_model=schemas.User)
+@router.post("/token/refresh")
+async def refresh_access_token(
+    refresh_token: str = Form(...),
+    db: AnySession = Depends(get_db),
+    services: Services = Depends(get_services),
+):
+    """
+    Exchange a refresh token for a new access token and refresh token.
+
+    Each refresh token can be used once, reusing one revokes every token rotated from the same login.
+    """
+    rotated = await crud_async.rotate_refresh_token(db, refresh_token)
+    if rotated is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    user, new_refresh_token = rotated
+    if not user.is_active:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Inactive user"
+        )
+    return {
+        "access_token": services.tokens.create_user_access_token(user),
+        "refresh_token": new_refresh_token,
+        "token_type": "bearer",
+    }
+
+
+@router.post("/token/revoke")
+async def revoke_access_token(
+    token: str = Depends(oauth2_scheme),
+    db: AnySession = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user),
+    services: Services = Depends(get_services),
+):
+    """
+    Revoke the access token used to make this request.
+    """
+    payload = services.tokens.decode_access_token(token)
+    jti = payload.get("jti")
+    if jti is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This token can not be revoked",
+        )
+    expires_at = datetime.utcfromtimestamp(payload["exp"])
+    await crud_async.revoke_access_token(db, jti, current_user.id, expires_at)
+    services.revocation_index.revoke(jti, payload["exp"])
+    return {"detail": "Token revoked"}
+
+
+@router.get("/users/me", response_model=schemas.User)
 async def read_users_me(
     current_user: models.User = Depends(get_current_active_user),
 ):
@@ -88,3 +387,64 @@ async def read_users_me(
     Get current user.
     """
     return current_user
+
+
+@router.get("/stats/caches")
+async def read_cache_stats(
+    current_user: models.User = Depends(get_current_active_superuser),
+    services: Services = Depends(get_services),
+):
+    """
+    Get size, hit ratio and eviction counts of the in-process caches.
+    """
+    return {
+        "principal": services.principal_cache.stats(),
+        "token": services.token_cache.stats(),
+    }
+
+
+@router.get("/stats/pools")
+async def read_pool_stats(
+    current_user: models.User = Depends(get_current_active_superuser),
+    services: Services = Depends(get_services),
+):
+    """
+    Get connection counts and checkout wait times of the database connection pools.
+    """
+    return services.database.pool_stats()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """
+    Request latencies, per-stage timings and cache, pool and hashing state for Prometheus.
+    """
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@router.get("/.well-known/jwks.json")
+async def read_jwks(request: Request, services: Services = Depends(get_services)):
+    """
+    Public keys other services can use to verify access tokens locally.
+    """
+    key_ring = services.tokens.key_ring
+    headers = {
+        "ETag": key_ring.jwks_etag,
+        "Cache-Control": f"public, max-age={services.settings.JWKS_MAX_AGE}",
+    }
+    if request.headers.get("if-none-match") == key_ring.jwks_etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(
+        content=key_ring.jwks, media_type="application/json", headers=headers
+    )
+
+
+app = create_app()
+metrics.register_state_metrics(
+    {
+        "principal": app.state.services.principal_cache,
+        "token": app.state.services.token_cache,
+    },
+    app.state.services.database.pool_stats,
+    app.state.services.hasher,
+)
@@ -0,0 +1,160 @@
+"""Production server, gunicorn managing uvicorn workers
+
+    poetry run oauth-app-server --workers 4
+    python -m oauth_app.server
+
+The app is imported and the password hashing context loaded once, in the
+master process, before the workers are forked, so workers start fast and share
+that memory copy-on-write. Nothing connects to the database before the fork,
+each worker opens its own connections in the app's startup event. On SIGTERM
+workers stop accepting connections and get `SERVER_GRACEFUL_TIMEOUT` seconds to
+finish the requests in flight.
+"""
+import argparse
+import gc
+import os
+import subprocess
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from fastapi import FastAPI
+from gunicorn.app.base import BaseApplication
+
+from oauth_app.app.config import settings
+
+
+def load_app() -> FastAPI:
+    """Import the app and do the one-off work every worker would otherwise repeat."""
+    from oauth_app.app import hashing
+    from oauth_app.main import app
+
+    # Loads the hashing backend and computes the hash unknown emails are checked against.
+    hashing.dummy_hash(app.state.services.hasher.policy)
+    # Keep the collector from writing to the shared objects in the workers, which
+    # would copy the pages they live on.
+    gc.collect()
+    gc.freeze()
+    return app
+
+
+def get_options(
+    host: str,
+    port: int,
+    workers: Optional[int],
+    graceful_timeout: int,
+    forwarded_allow_ips: str = "127.0.0.1",
+) -> Dict[str, Any]:
+    """gunicorn settings of the server.
+
+    Args:
+        workers (Optional[int]): Number of worker processes, defaults to the CPU count.
+        graceful_timeout (int): Seconds workers get to finish their requests on shutdown.
+        forwarded_allow_ips (str): Proxies trusted to set `X-Forwarded-For`, the
+            uvicorn workers then see the client's IP instead of the proxy's.
+    """
+    return {
+        "bind": f"{host}:{port}",
+        "workers": workers or os.cpu_count() or 1,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": True,
+        "graceful_timeout": graceful_timeout,
+        "forwarded_allow_ips": forwarded_allow_ips,
+    }
+
+
+def parse_importtime(output: str) -> List[Tuple[str, int, int]]:
+    """Modules in the `-X importtime` report, in import order.
+
+    Returns:
+        List[Tuple[str, int, int]]: Module name, own and cumulative microseconds.
+    """
+    modules = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|", 2)
+        if own.strip().isdigit():
+            modules.append((name.strip(), int(own), int(cumulative)))
+    return modules
+
+
+def profile_startup(top: int = 25) -> str:
+    """Import the app in a fresh interpreter and report the slowest modules."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import oauth_app.main"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    modules = parse_importtime(result.stderr)
+    total = next(
+        cumulative for name, _, cumulative in modules if name == "oauth_app.main"
+    )
+    lines = [
+        f"Importing oauth_app.main took {total / 1000:.1f} ms",
+        f"{'self ms':>9} {'cumulative ms':>14}  module",
+    ]
+    for name, own, cumulative in sorted(modules, key=lambda m: m[1], reverse=True)[
+        :top
+    ]:
+        lines.append(f"{own / 1000:>9.1f} {cumulative / 1000:>14.1f}  {name}")
+    return "\n".join(lines)
+
+
+class Server(BaseApplication):
+    def __init__(self, options: Dict[str, Any]):
+        self.options = options
+        super().__init__()
+
+    def load_config(self) -> None:
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+    def load(self) -> FastAPI:
+        return load_app()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=settings.SERVER_WORKERS,
+        help="Worker processes, defaults to the CPU count.",
+    )
+    parser.add_argument(
+        "--graceful-timeout", type=int, default=settings.SERVER_GRACEFUL_TIMEOUT
+    )
+    parser.add_argument(
+        "--forwarded-allow-ips",
+        default=settings.SERVER_FORWARDED_ALLOW_IPS,
+        help="Proxy IPs whose X-Forwarded-For header gives the client IP.",
+    )
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Report the time each module takes to import instead of serving.",
+    )
+    args = parser.parse_args()
+
+    if args.profile_startup:
+        print(profile_startup())
+        return
+    options = get_options(
+        args.host,
+        args.port,
+        args.workers,
+        args.graceful_timeout,
+        args.forwarded_allow_ips,
+    )
+    Server(options).run()
+
+
+if __name__ == "__main__":
+    main()
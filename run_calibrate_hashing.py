@@ -0,0 +1,28 @@
+"""Measure password hashing latency on this host and recommend cost settings
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+from oauth_app.app.config import settings
+from oauth_app.app.hashing import build_crypt_context, calibrate, measure_hash_ms
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scheme", default=settings.PASSWORD_HASH_SCHEME)
+    parser.add_argument(
+        "--target-ms",
+        type=float,
+        default=settings.PASSWORD_HASH_TARGET_MS,
+        help="Longest acceptable time to hash or verify one password.",
+    )
+    args = parser.parse_args()
+
+    print(
+        f"Current policy: {measure_hash_ms(build_crypt_context(settings)):.1f} ms per hash"
+    )
+    result = calibrate(args.scheme, args.target_ms, settings)
+    print(f"Recommended ({result['measured_ms']:.1f} ms per hash):")
+    for name, value in result["settings"].items():
+        print(f'export {name}="{value}"')
@@ -0,0 +1,38 @@
+"""Create users in bulk from an NDJSON or CSV file
+"""
+import argparse
+import json
+import sys
+
+from dotenv import load_dotenv
+
+load_dotenv()
+from oauth_app.app.config import settings
+from oauth_app.app.database.session import SessionLocal
+from oauth_app.app.user_import import FORMATS, import_users
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("path", help="File to import, one user per line.")
+    parser.add_argument(
+        "--format",
+        choices=FORMATS,
+        help="Input format, guessed from the file extension by default.",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=settings.USER_IMPORT_BATCH_SIZE
+    )
+    args = parser.parse_args()
+
+    format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    db = SessionLocal()
+    try:
+        with open(args.path, newline="") as f:
+            result = import_users(
+                db, (line.rstrip("\r\n") for line in f), format, args.batch_size
+            )
+    finally:
+        db.close()
+    for error in result.errors:
+        print(json.dumps(error.dict()), file=sys.stderr)
+    print(f"Created {result.created} users, {len(result.errors)} errors")
@@ -3,11 +3,25 @@ from unittest import mock
 from typing import Iterator, Dict
 
 import pytest
+from _pytest.config import Config as PytestConfig
+from _pytest.fixtures import FixtureRequest
 from dotenv import load_dotenv
 
 load_dotenv(".test.env")  # Export test env vars first to ensure they have priority
 load_dotenv()
 
+from tests.db_backends import (
+    create_postgres_database,
+    create_sqlite_database,
+    database_url,
+    get_backend,
+)
+
+# The application reads the database URL when it is imported.
+TEST_DB_BACKEND = get_backend()
+if TEST_DB_BACKEND != "docker":
+    os.environ["DATABASE_URL"] = database_url(TEST_DB_BACKEND)
+
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
 
@@ -19,6 +33,21 @@ from tests.utils import authentication_token_from_email
 from tests.docker_services.postgres import postgres_db  # noqa
 
 
+@pytest.fixture(scope="session", autouse=True)
+def test_database(
+    request: FixtureRequest,
+    pytestconfig: PytestConfig,
+    set_superuser_env_vars: None,
+) -> None:
+    """Provide a migrated database with a superuser, see `tests.db_backends`."""
+    if TEST_DB_BACKEND == "docker":
+        request.getfixturevalue("postgres_db")
+    elif TEST_DB_BACKEND == "postgres":
+        create_postgres_database(pytestconfig.rootdir)
+    else:
+        create_sqlite_database()
+
+
 @pytest.fixture(scope="module")
 def client() -> Iterator[TestClient]:
     with TestClient(app) as c:
@@ -0,0 +1,141 @@
+"""Databases the test suite can run against, chosen with `TEST_DB_BACKEND`.
+
+- `docker` (default): Postgres started with docker-compose and migrated.
+- `postgres`: an already running Postgres server. A template database is
+  migrated once and reused while it is at the Alembic head, each pytest-xdist
+  worker gets its own copy of it.
+- `sqlite`: a SQLite file per worker, with the tables created from the models.
+
+This module is imported before the application, which reads `DATABASE_URL`
+when it is imported, so it only imports the application inside functions.
+"""
+import os
+import tempfile
+from pathlib import Path
+from typing import Optional, Union
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import NullPool
+
+BACKENDS = ("docker", "postgres", "sqlite")
+
+# Serializes the workers that start together, the first one builds the template.
+TEMPLATE_LOCK_KEY = 4283519
+
+
+def get_backend() -> str:
+    backend = os.environ.get("TEST_DB_BACKEND", "docker")
+    if backend not in BACKENDS:
+        raise ValueError(f"TEST_DB_BACKEND must be one of {', '.join(BACKENDS)}")
+    return backend
+
+
+def worker_id() -> str:
+    """Name of the pytest-xdist worker running this process, `main` without xdist."""
+    return os.environ.get("PYTEST_XDIST_WORKER", "main")
+
+
+def postgres_url(database: str) -> str:
+    user = os.environ["POSTGRES_USER"]
+    password = os.environ["POSTGRES_PASS"]
+    server = os.environ.get("POSTGRES_SERVER", "localhost")
+    port = os.environ["POSTGRES_TEST_PORT"]
+    return f"postgresql://{user}:{password}@{server}:{port}/{database}"
+
+
+def database_url(backend: str) -> Optional[str]:
+    """URL of this worker's database, None to use the configured one.
+
+    Args:
+        backend (str): One of `BACKENDS`.
+    """
+    if backend == "postgres":
+        return postgres_url(f"{os.environ['POSTGRES_DB']}_{worker_id()}")
+    if backend == "sqlite":
+        path = os.path.join(tempfile.gettempdir(), f"oauth_app_test_{worker_id()}.db")
+        return f"sqlite:///{path}"
+    return None
+
+
+def _template_revision(url: str) -> Optional[str]:
+    engine = create_engine(url, poolclass=NullPool)
+    try:
+        with engine.connect() as conn:
+            return conn.execute(
+                text("SELECT version_num FROM alembic_version")
+            ).scalar()
+    except DBAPIError:
+        return None
+    finally:
+        engine.dispose()
+
+
+def _create_superuser(url: str) -> None:
+    from oauth_app.app.database.init_db import create_superuser
+
+    engine = create_engine(url, poolclass=NullPool)
+    db = Session(bind=engine)
+    try:
+        create_superuser(db)
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def create_postgres_database(root_dir: Union[str, Path]) -> None:
+    """Create this worker's database as a copy of the migrated template database.
+
+    Copying the template takes a fraction of a second, the migrations only run
+    again once a new revision is added.
+
+    Args:
+        root_dir (Union[str, Path]): Root directory of this project, needed in order to find the `alembic.ini` file.
+    """
+    from alembic.config import Config as AlembicConfig
+    from alembic.script import ScriptDirectory
+
+    from oauth_app.app.database.init_db import migrate_db
+
+    name = f"{os.environ['POSTGRES_DB']}_{worker_id()}"
+    template = f"{os.environ['POSTGRES_DB']}_template"
+    alembic_cfg = AlembicConfig(os.path.join(root_dir, "alembic.ini"))
+    head = ScriptDirectory.from_config(alembic_cfg).get_current_head()
+
+    admin = create_engine(
+        postgres_url("postgres"), isolation_level="AUTOCOMMIT", poolclass=NullPool
+    )
+    try:
+        with admin.connect() as conn:
+            conn.execute(
+                text("SELECT pg_advisory_lock(:key)"), {"key": TEMPLATE_LOCK_KEY}
+            )
+            try:
+                exists = conn.execute(
+                    text("SELECT 1 FROM pg_database WHERE datname = :name"),
+                    {"name": template},
+                ).scalar()
+                if not exists or _template_revision(postgres_url(template)) != head:
+                    conn.execute(text(f'DROP DATABASE IF EXISTS "{template}"'))
+                    conn.execute(text(f'CREATE DATABASE "{template}"'))
+                    migrate_db(root_dir, url=postgres_url(template))
+                    _create_superuser(postgres_url(template))
+                conn.execute(text(f'DROP DATABASE IF EXISTS "{name}"'))
+                conn.execute(text(f'CREATE DATABASE "{name}" TEMPLATE "{template}"'))
+            finally:
+                conn.execute(
+                    text("SELECT pg_advisory_unlock(:key)"), {"key": TEMPLATE_LOCK_KEY}
+                )
+    finally:
+        admin.dispose()
+
+
+def create_sqlite_database() -> None:
+    """Recreate the tables of this worker's SQLite database and add the superuser."""
+    from oauth_app.app.database.base import Base
+    from oauth_app.app.database.session import engine
+
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    _create_superuser(str(engine.url))
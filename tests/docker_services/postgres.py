@@ -12,7 +12,7 @@ from oauth_app.app.database.init_db import migrate_db, create_superuser
 from tests.utils import is_process_responsive, wait_until_responsive
 
 
-@pytest.fixture(scope="session", autouse=True)
+@pytest.fixture(scope="session")
 def postgres_db(
     pytestconfig: PytestConfig, db: Session, set_superuser_env_vars: None
 ) -> None:
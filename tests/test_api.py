@@ -1,11 +1,27 @@
+import json
+import threading
+import time
+from datetime import datetime, timedelta
 from typing import Dict
 
+import pytest
 from fastapi import status
 from fastapi.testclient import TestClient
+from passlib.hash import bcrypt
 from sqlalchemy.orm import Session
 
+from oauth_app.app import models
 from oauth_app.app import schemas
 from oauth_app.app import crud
+from oauth_app.app import crud_async
+from oauth_app.app import hashing
+from oauth_app.app import rate_limit
+from oauth_app.app import security
+from oauth_app.app import user_import
+from oauth_app.app.config import settings
+from oauth_app.app.database.session import SessionLocal
+from oauth_app.app.hashing import PasswordHashingPool, crypt_context
+from oauth_app.app.services import Services, get_default_services
 
 from tests.utils import authentication_token_from_email
 
@@ -16,13 +32,12 @@ def test_get_root(client: TestClient):
     assert response.json() == {"message": "Hello World"}
 
 
-def test_create_user(client: TestClient):
+def test_create_user(client: TestClient, db: Session):
     email = "josh@example.com"
     full_name = "Josh Doe"
     password = "fake_pass_123"
     data = {"email": email, "full_name": full_name, "password": password}
     expected = {
-        "id": 2,
         "email": "josh@example.com",
         "full_name": "Josh Doe",
         "is_active": True,
@@ -32,7 +47,8 @@ def test_create_user(client: TestClient):
     resp = client.post("/users", json=data)
     actual = resp.json()
     assert resp.status_code == status.HTTP_200_OK
-    assert expected == actual
+    assert expected == {k: v for k, v in actual.items() if k != "id"}
+    assert actual["id"] == crud.get_user_by_email(db, email).id
 
 
 def test_login_user(client: TestClient, db: Session):
@@ -58,7 +74,6 @@ def test_get_authenticated_active_user(client: TestClient, db: Session):
     full_name = "John Doe"
     password = "fake_pass_123"
     expected = {
-        "id": 4,
         "is_active": True,
         "email": "john@example.com",
         "full_name": "John Doe",
@@ -69,6 +84,7 @@ def test_get_authenticated_active_user(client: TestClient, db: Session):
     user_token_headers = authentication_token_from_email(
         client=client, db=db, email=email, password=password, full_name=full_name
     )
+    expected["id"] = crud.get_user_by_email(db, email).id
     resp = client.get("/users/me", headers=user_token_headers)
     actual = resp.json()
     assert resp.status_code == status.HTTP_200_OK
@@ -106,7 +122,6 @@ def test_get_unauthenticated_user(client: TestClient):
 def test_set_user_as_inactive_with_superuser(
     client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
 ):
-    user_id = 5
     email = "jen@example.com"
     full_name = "Jen Doe"
     password = "fake_pass_123"
@@ -116,11 +131,11 @@ def test_set_user_as_inactive_with_superuser(
         "full_name": "Jen Doe",
         "is_active": False,
         "is_superuser": False,
-        "id": 5,
     }
 
     user_in = schemas.UserCreate(email=email, full_name=full_name, password=password)
-    crud.create_user(db, user_in)
+    user_id = crud.create_user(db, user_in).id
+    expected["id"] = user_id
     resp = client.put(f"/users/{user_id}", headers=superuser_token_headers, json=data)
     actual = resp.json()
     assert resp.status_code == status.HTTP_200_OK
@@ -148,3 +163,782 @@ def test_get_inactive_user(client: TestClient, db: Session):
     actual = resp.json()
     assert resp.status_code == status.HTTP_400_BAD_REQUEST
     assert expected == actual
+
+
+def test_login_with_saturated_hashing_pool(client: TestClient, monkeypatch):
+    pool = PasswordHashingPool(settings, kind="thread", max_workers=1, max_queue=0)
+    monkeypatch.setattr(get_default_services(), "hasher", pool)
+    release = threading.Event()
+    pool.submit(release.wait)
+    login_data = {"username": "admin@example.com", "password": "admin"}
+
+    try:
+        resp = client.post("/token", data=login_data)
+    finally:
+        release.set()
+        pool.shutdown()
+    assert resp.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert resp.headers["Retry-After"] == "1"
+
+
+def test_deactivation_invalidates_cached_user(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    email = "kim@example.com"
+    full_name = "Kim Doe"
+    password = "fake_pass_123"
+    expected = {"detail": "Inactive user"}
+
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email=email, password=password, full_name=full_name
+    )
+    # First request caches the active user.
+    resp = client.get("/users/me", headers=user_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+    user = crud.get_user_by_email(db, email=email)
+    resp = client.put(
+        f"/users/{user.id}", headers=superuser_token_headers, json={"is_active": False}
+    )
+    assert resp.status_code == status.HTTP_200_OK
+
+    resp = client.get("/users/me", headers=user_token_headers)
+    actual = resp.json()
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert expected == actual
+
+
+def test_get_user_from_token_claims(client: TestClient, db: Session, monkeypatch):
+    email = "lee@example.com"
+    full_name = "Lee Doe"
+    password = "fake_pass_123"
+    monkeypatch.setattr(settings, "TOKEN_CLAIMS_MODE", True)
+
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email=email, password=password, full_name=full_name
+    )
+    user = crud.get_user_by_email(db, email=email)
+    expected = {
+        "id": user.id,
+        "email": email,
+        "full_name": full_name,
+        "is_active": True,
+        "is_superuser": False,
+    }
+
+    async def fail_lookup(*args, **kwargs):
+        raise AssertionError("Claims mode should not look the user up")
+
+    monkeypatch.setattr(crud_async, "get_user_by_email", fail_lookup)
+    resp = client.get("/users/me", headers=user_token_headers)
+    actual = resp.json()
+    assert resp.status_code == status.HTTP_200_OK
+    assert expected == actual
+
+
+def test_repeated_token_hits_token_cache(
+    client: TestClient, superuser_token_headers: Dict[str, str]
+):
+    resp = client.get("/stats/caches", headers=superuser_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+    hits_before = resp.json()["token"]["hits"]
+
+    resp = client.get("/users/me", headers=superuser_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+    resp = client.get("/stats/caches", headers=superuser_token_headers)
+    actual = resp.json()
+    assert resp.status_code == status.HTTP_200_OK
+    assert actual["token"]["hits"] == hits_before + 2
+    assert set(actual["principal"]) == set(actual["token"])
+
+
+def test_refresh_token_rotation(client: TestClient, db: Session):
+    email = "max@example.com"
+    password = "fake_pass_123"
+    user_in = schemas.UserCreate(email=email, password=password)
+    crud.create_user(db, user_in)
+    resp = client.post("/token", data={"username": email, "password": password})
+    refresh_token = resp.json()["refresh_token"]
+
+    resp = client.post("/token/refresh", data={"refresh_token": refresh_token})
+    actual = resp.json()
+    assert resp.status_code == status.HTTP_200_OK
+    assert actual["access_token"]
+    assert actual["refresh_token"] != refresh_token
+
+    headers = {"Authorization": f"Bearer {actual['access_token']}"}
+    resp = client.get("/users/me", headers=headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["email"] == email
+
+
+def test_refresh_token_reuse_revokes_family(client: TestClient, db: Session):
+    email = "ned@example.com"
+    password = "fake_pass_123"
+    expected = {"detail": "Invalid refresh token"}
+    user_in = schemas.UserCreate(email=email, password=password)
+    crud.create_user(db, user_in)
+    resp = client.post("/token", data={"username": email, "password": password})
+    first_refresh_token = resp.json()["refresh_token"]
+    resp = client.post("/token/refresh", data={"refresh_token": first_refresh_token})
+    second_refresh_token = resp.json()["refresh_token"]
+
+    # Replaying the consumed token also revokes the token rotated from it.
+    resp = client.post("/token/refresh", data={"refresh_token": first_refresh_token})
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    assert expected == resp.json()
+    resp = client.post("/token/refresh", data={"refresh_token": second_refresh_token})
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    assert expected == resp.json()
+
+
+def test_revoked_access_token_is_rejected(client: TestClient, db: Session):
+    email = "olga@example.com"
+    password = "fake_pass_123"
+    expected = {"detail": "Could not validate credentials"}
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email=email, password=password
+    )
+
+    resp = client.post("/token/revoke", headers=user_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+    resp = client.get("/users/me", headers=user_token_headers)
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    assert expected == resp.json()
+    # Other tokens of the same user are unaffected.
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email=email, password=password
+    )
+    resp = client.get("/users/me", headers=user_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+
+def test_revoke_all_user_tokens_with_superuser(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    email = "pia@example.com"
+    password = "fake_pass_123"
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email=email, password=password
+    )
+    resp = client.post("/token", data={"username": email, "password": password})
+    refresh_token = resp.json()["refresh_token"]
+    user = crud.get_user_by_email(db, email=email)
+
+    resp = client.post(
+        f"/users/{user.id}/revoke-tokens", headers=superuser_token_headers
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == {"token_generation": 1}
+
+    resp = client.get("/users/me", headers=user_token_headers)
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    resp = client.post("/token/refresh", data={"refresh_token": refresh_token})
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    # Tokens issued after the revocation work.
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email=email, password=password
+    )
+    resp = client.get("/users/me", headers=user_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+
+
+def test_expired_token_revocations_are_pruned(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    user = crud.create_user(
+        db, schemas.UserCreate(email="rae@example.com", password="fake_pass_123")
+    )
+    crud.revoke_access_token(
+        db, "expired", user.id, datetime.utcnow() - timedelta(seconds=1)
+    )
+
+    resp = client.post(
+        f"/users/{user.id}/revoke-tokens", headers=superuser_token_headers
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    db.expire_all()
+    jtis = {row.jti for row in crud.get_token_revocations(db, after_id=0)}
+    assert "expired" not in jtis
+
+
+def test_login_upgrades_outdated_password_hash(client: TestClient, db: Session):
+    email = "quinn@example.com"
+    password = "fake_pass_123"
+    outdated_hash = bcrypt.using(rounds=4).hash(password)
+    user_in = schemas.UserCreate(email=email, password=password)
+    crud.create_user(db, user_in, hashed_password=outdated_hash)
+
+    resp = client.post("/token", data={"username": email, "password": password})
+    assert resp.status_code == status.HTTP_200_OK
+
+    db.expire_all()
+    user = crud.get_user_by_email(db, email=email)
+    assert user.hashed_password != outdated_hash
+    assert security.verify_password(db, password, user.hashed_password)
+    policy = get_default_services().hasher.policy
+    assert not crypt_context(policy).needs_update(user.hashed_password)
+
+
+def test_create_user_with_registered_email(client: TestClient):
+    data = {"email": "admin@example.com", "password": "fake_pass_123"}
+    expected = {"detail": "Email already registered"}
+
+    resp = client.post("/users", json=data)
+    actual = resp.json()
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert expected == actual
+
+
+def test_create_user_losing_a_race_returns_none(db: Session):
+    email = "race@example.com"
+    # Another request registers the email first, in its own session.
+    other_db = SessionLocal()
+    try:
+        other_db.execute(
+            models.User.__table__.insert().values(
+                email=email, hashed_password="other", is_active=True
+            )
+        )
+        other_db.commit()
+    finally:
+        other_db.close()
+
+    user_in = schemas.UserCreate(email=email, password="fake_pass_123")
+    assert crud.create_user(db, user_in, hashed_password="hash") is None
+    # The failed insert left the session usable.
+    assert crud.get_user_by_email(db, email=email).hashed_password == "other"
+
+
+def test_import_users_ndjson_with_superuser(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    hashed_password = bcrypt.using(rounds=4).hash("fake_pass_123")
+    lines = [
+        {"email": "rosa@example.com", "password": "fake_pass_123"},
+        {"email": "sam@example.com", "hashed_password": hashed_password},
+        {"email": "admin@example.com", "password": "fake_pass_123"},
+        {"email": "not-an-email", "password": "fake_pass_123"},
+        {"email": "tess@example.com", "hashed_password": "plain"},
+        {"email": "rosa@example.com", "password": "fake_pass_123"},
+    ]
+    body = "\n".join(json.dumps(line) for line in lines) + "\n{not json\n"
+
+    resp = client.post(
+        "/users:bulk",
+        data=body,
+        headers={**superuser_token_headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    result = resp.json()
+    assert result["created"] == 2
+    assert [error["line"] for error in result["errors"]] == [3, 4, 5, 6, 7]
+    assert result["errors"][0]["error"] == "Email already registered"
+
+    resp = client.post(
+        "/token", data={"username": "sam@example.com", "password": "fake_pass_123"}
+    )
+    assert resp.status_code == status.HTTP_200_OK
+
+
+def test_import_users_csv_in_batches(
+    client: TestClient,
+    db: Session,
+    superuser_token_headers: Dict[str, str],
+    monkeypatch,
+):
+    monkeypatch.setattr(settings, "USER_IMPORT_BATCH_SIZE", 2)
+    body = (
+        "email,full_name,password,is_active\n"
+        "uma@example.com,Uma,fake_pass_123,\n"
+        "vic@example.com,,fake_pass_123,false\n"
+        "walt@example.com,Walt\n"
+    )
+
+    resp = client.post(
+        "/users:bulk",
+        data=body,
+        headers={**superuser_token_headers, "Content-Type": "text/csv"},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == {
+        "created": 2,
+        "errors": [{"line": 4, "error": "Expected 4 fields, got 2"}],
+    }
+    assert crud.get_user_by_email(db, email="uma@example.com").is_active
+    assert not crud.get_user_by_email(db, email="vic@example.com").is_active
+
+
+def test_import_users_reports_rejected_passwords(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    records = [
+        {"email": "xena@example.com", "password": "fake_pass_123"},
+        # bcrypt does not allow NUL bytes.
+        {"email": "yuri@example.com", "password": "fake\u0000pass"},
+        {"email": "zack@example.com", "password": "fake_pass_123"},
+    ]
+    body = "\n".join(json.dumps(record) for record in records)
+
+    resp = client.post(
+        "/users:bulk",
+        data=body,
+        headers={**superuser_token_headers, "Content-Type": "application/x-ndjson"},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    result = resp.json()
+    assert result["created"] == 2
+    assert [error["line"] for error in result["errors"]] == [2]
+    assert result["errors"][0]["error"].startswith("password: ")
+    assert crud.get_user_by_email(db, email="yuri@example.com") is None
+    assert crud.get_user_by_email(db, email="zack@example.com") is not None
+
+
+def test_login_while_import_is_hashing(client: TestClient, monkeypatch):
+    pool = PasswordHashingPool(settings, kind="thread", max_workers=2, max_queue=2)
+    monkeypatch.setattr(get_default_services(), "hasher", pool)
+    release = threading.Event()
+
+    def hash_password(policy: str, password: str) -> str:
+        release.wait()
+        return hashing.hash_password(policy, password)
+
+    monkeypatch.setattr(user_import, "hash_password", hash_password)
+    lines = [
+        json.dumps({"email": f"imp{i}@example.com", "password": "fake_pass_123"})
+        for i in range(10)
+    ]
+    results = []
+
+    def import_users() -> None:
+        db = SessionLocal()
+        try:
+            results.append(user_import.import_users(db, lines, "ndjson", 100))
+        finally:
+            db.close()
+
+    importer = threading.Thread(target=import_users)
+    importer.start()
+    try:
+        while pool.in_flight == 0:
+            time.sleep(0.01)
+        login_data = {"username": "admin@example.com", "password": "admin"}
+        resp = client.post("/token", data=login_data)
+        assert resp.status_code == status.HTTP_200_OK
+    finally:
+        release.set()
+        importer.join()
+        pool.shutdown()
+    assert results[0].created == 10
+
+
+def test_import_users_rejects_unknown_content_type(
+    client: TestClient, superuser_token_headers: Dict[str, str]
+):
+    resp = client.post(
+        "/users:bulk",
+        data="<users/>",
+        headers={**superuser_token_headers, "Content-Type": "application/xml"},
+    )
+    assert resp.status_code == status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+
+
+def test_list_users_with_superuser(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    for email in ["page_1@example.com", "page_2@example.com", "page_3@example.com"]:
+        crud.create_user(db, schemas.UserCreate(email=email, password="fake_pass_123"))
+    # `_` in the prefix must not act as a wildcard.
+    crud.create_user(
+        db, schemas.UserCreate(email="pagex@example.com", password="fake_pass_123")
+    )
+    params = {"email_prefix": "page_", "limit": 2, "fields": "email"}
+
+    resp = client.get("/users", params=params, headers=superuser_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+    page = resp.json()
+    assert [item["email"] for item in page["items"]] == [
+        "page_1@example.com",
+        "page_2@example.com",
+    ]
+    assert set(page["items"][0]) == {"id", "email"}
+    assert page["next_after"] == page["items"][-1]["id"]
+
+    params["after"] = page["next_after"]
+    resp = client.get("/users", params=params, headers=superuser_token_headers)
+    page = resp.json()
+    assert [item["email"] for item in page["items"]] == ["page_3@example.com"]
+    assert page["next_after"] is None
+
+
+def test_list_users_filters(
+    client: TestClient, superuser_token_headers: Dict[str, str]
+):
+    resp = client.get(
+        "/users", params={"is_superuser": True}, headers=superuser_token_headers
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    items = resp.json()["items"]
+    assert items and all(item["is_superuser"] for item in items)
+    assert set(items[0]) == set(schemas.UserFields.__fields__)
+
+    resp = client.get(
+        "/users", params={"fields": "email,password"}, headers=superuser_token_headers
+    )
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+    assert resp.json() == {"detail": "Unknown fields: password"}
+
+
+def test_list_users_with_normal_user(client: TestClient, db: Session):
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email="xena@example.com", password="fake_pass_123"
+    )
+    resp = client.get("/users", headers=user_token_headers)
+    assert resp.status_code == status.HTTP_400_BAD_REQUEST
+
+
+def test_export_users_with_superuser(
+    client: TestClient,
+    db: Session,
+    superuser_token_headers: Dict[str, str],
+    monkeypatch,
+):
+    monkeypatch.setattr(settings, "USER_EXPORT_BATCH_SIZE", 2)
+    user_count = db.query(models.User).count()
+
+    resp = client.get("/users/export", headers=superuser_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"] == "application/x-ndjson"
+    users = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(users) == user_count
+    assert [user["id"] for user in users] == sorted(user["id"] for user in users)
+    admin = next(user for user in users if user["email"] == "admin@example.com")
+    assert admin["is_superuser"] is True
+    assert "hashed_password" not in admin
+
+    resp = client.get(
+        "/users/export", params={"format": "csv"}, headers=superuser_token_headers
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    lines = resp.text.splitlines()
+    assert lines[0] == "id,email,full_name,is_active,is_superuser"
+    assert len(lines) == user_count + 1
+
+
+def test_bulk_deactivate_users_by_ids(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    password = "fake_pass_123"
+    emails = ["yara@example.com", "zed@example.com"]
+    headers = [
+        authentication_token_from_email(
+            client=client, db=db, email=email, password=password
+        )
+        for email in emails
+    ]
+    # Cache both principals before deactivating them.
+    for user_token_headers in headers:
+        resp = client.get("/users/me", headers=user_token_headers)
+        assert resp.status_code == status.HTTP_200_OK
+    ids = [crud.get_user_by_email(db, email=email).id for email in emails]
+
+    resp = client.patch(
+        "/users:bulk",
+        headers=superuser_token_headers,
+        json={"ids": ids + [10 ** 6], "patch": {"is_active": False}},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == {"updated": 2}
+    for user_token_headers in headers:
+        resp = client.get("/users/me", headers=user_token_headers)
+        assert resp.status_code == status.HTTP_400_BAD_REQUEST
+        assert resp.json() == {"detail": "Inactive user"}
+
+
+def test_bulk_update_users_by_filter(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    for email in ["bulk_1@example.com", "bulk_2@example.com"]:
+        crud.create_user(db, schemas.UserCreate(email=email, password="fake_pass_123"))
+
+    resp = client.patch(
+        "/users:bulk",
+        headers=superuser_token_headers,
+        json={"filter": {"email_prefix": "bulk_"}, "patch": {"full_name": "Bulk"}},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json() == {"updated": 2}
+    db.expire_all()
+    assert crud.get_user_by_email(db, email="bulk_2@example.com").full_name == "Bulk"
+
+
+def test_bulk_update_users_requires_target(
+    client: TestClient, superuser_token_headers: Dict[str, str]
+):
+    for data in [
+        {"patch": {"is_active": False}},
+        {"filter": {}, "patch": {"is_active": False}},
+        {"ids": [1], "patch": {}},
+        {"filter": {"email_prefix": ""}, "patch": {"is_active": False}},
+        {"filter": {"email_prefix": "  "}, "patch": {"is_active": False}},
+    ]:
+        resp = client.patch("/users:bulk", headers=superuser_token_headers, json=data)
+        assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+
+def test_bulk_update_users_rejects_null_flags(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    email = "bulk_null@example.com"
+    password = "fake_pass_123"
+    user = crud.create_user(db, schemas.UserCreate(email=email, password=password))
+
+    for patch in [{"is_active": None}, {"is_superuser": None}]:
+        resp = client.patch(
+            "/users:bulk",
+            headers=superuser_token_headers,
+            json={"ids": [user.id], "patch": patch},
+        )
+        assert resp.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    # A null full name is fine, the column is nullable.
+    resp = client.patch(
+        "/users:bulk",
+        headers=superuser_token_headers,
+        json={"ids": [user.id], "patch": {"full_name": None}},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email=email, password=password
+    )
+    assert client.get("/users/me", headers=user_token_headers).status_code == 200
+
+
+def test_bulk_update_users_refuses_an_empty_filter(db: Session):
+    with pytest.raises(ValueError):
+        crud.bulk_update_users(
+            db, values={"is_active": False}, filters=schemas.UserFilter()
+        )
+
+
+def test_update_user_password_with_superuser(
+    client: TestClient, db: Session, superuser_token_headers: Dict[str, str]
+):
+    email = "abby@example.com"
+    user = crud.create_user(
+        db, schemas.UserCreate(email=email, password="fake_pass_123")
+    )
+
+    resp = client.put(
+        f"/users/{user.id}",
+        headers=superuser_token_headers,
+        json={"password": "new_pass_456", "full_name": "Abby Doe"},
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.json()["full_name"] == "Abby Doe"
+    assert "password" not in resp.json()
+
+    resp = client.post("/token", data={"username": email, "password": "fake_pass_123"})
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    resp = client.post("/token", data={"username": email, "password": "new_pass_456"})
+    assert resp.status_code == status.HTTP_200_OK
+
+
+def test_read_pool_stats_with_superuser(
+    client: TestClient, superuser_token_headers: Dict[str, str]
+):
+    resp = client.get("/stats/pools", headers=superuser_token_headers)
+    assert resp.status_code == status.HTTP_200_OK
+    primary = resp.json()["primary"]
+    assert primary["size"] == settings.DB_POOL_SIZE
+    assert primary["checkouts"] > 0
+
+
+def test_read_metrics(client: TestClient, db: Session):
+    user_token_headers = authentication_token_from_email(
+        client=client, db=db, email="bea@example.com", password="fake_pass_123"
+    )
+    client.get("/users/me", headers=user_token_headers)
+
+    resp = client.get("/metrics")
+    assert resp.status_code == status.HTTP_200_OK
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = resp.text
+    assert (
+        'http_request_duration_seconds_count{route="/users/me",method="GET",status="2xx"}'
+        in text
+    )
+    assert 'token_decode_duration_seconds_count{result="verified"}' in text
+    assert 'password_hash_duration_seconds_count{operation="verify_and_update"}' in text
+    assert 'db_query_duration_seconds_count{statement="select"}' in text
+    assert "response_build_duration_seconds_count " in text
+    assert 'cache_hits_total{cache="token"}' in text
+    assert 'db_pool_checked_out{engine="primary"}' in text
+    assert "password_hash_in_flight 0" in text
+
+
+def test_login_rate_limited_per_account(client: TestClient, db: Session, monkeypatch):
+    email = "cleo@example.com"
+    password = "fake_pass_123"
+    crud.create_user(db, schemas.UserCreate(email=email, password=password))
+    monkeypatch.setattr(
+        get_default_services(),
+        "login_account_limiter",
+        rate_limit.MemoryRateLimiter(2, 60, clock=lambda: 0.0),
+    )
+
+    def authenticate_user_async(*args, **kwargs):
+        raise AssertionError("Rejected attempts must not look up or hash")
+
+    for _ in range(2):
+        resp = client.post("/token", data={"username": email, "password": "wrong"})
+        assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    monkeypatch.setattr(security, "authenticate_user_async", authenticate_user_async)
+    # Locked out even with the right password.
+    resp = client.post("/token", data={"username": email, "password": password})
+    assert resp.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert resp.json() == {"detail": "Too many login attempts"}
+    assert resp.headers["Retry-After"] == "30"
+
+
+def test_login_takes_an_account_slot_before_hashing(
+    client: TestClient, db: Session, monkeypatch
+):
+    email = "dale@example.com"
+    password = "fake_pass_123"
+    crud.create_user(db, schemas.UserCreate(email=email, password=password))
+    limiter = rate_limit.MemoryRateLimiter(1, 60, clock=lambda: 0.0)
+    monkeypatch.setattr(get_default_services(), "login_account_limiter", limiter)
+    waits = []
+    authenticate_user_async = security.authenticate_user_async
+
+    async def recording_authenticate_user_async(db, email, password):
+        # A concurrent attempt would be told to wait this long.
+        waits.append(await limiter.check(email))
+        return await authenticate_user_async(db, email, password)
+
+    monkeypatch.setattr(
+        security, "authenticate_user_async", recording_authenticate_user_async
+    )
+    resp = client.post("/token", data={"username": email, "password": password})
+    assert resp.status_code == status.HTTP_200_OK
+    resp = client.post("/token", data={"username": email, "password": "wrong"})
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    resp = client.post("/token", data={"username": email, "password": password})
+    assert resp.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+
+    # The successful login gave its slot back, the failed one did not.
+    assert waits == [60, 60]
+
+
+def test_login_rate_limited_per_ip(client: TestClient, monkeypatch):
+    monkeypatch.setattr(
+        get_default_services(),
+        "login_ip_limiter",
+        rate_limit.MemoryRateLimiter(1, 60, clock=lambda: 0.0),
+    )
+    data = {"username": "admin@example.com", "password": "admin"}
+
+    resp = client.post("/token", data=data)
+    assert resp.status_code == status.HTTP_200_OK
+    resp = client.post("/token", data=data)
+    assert resp.status_code == status.HTTP_429_TOO_MANY_REQUESTS
+    assert resp.headers["Retry-After"] == "60"
+
+
+def test_login_unknown_email_skips_user_lookup(client: TestClient, monkeypatch):
+    # The first login builds the known email filter.
+    resp = client.post(
+        "/token", data={"username": "admin@example.com", "password": "admin"}
+    )
+    assert resp.status_code == status.HTTP_200_OK
+
+    async def get_user_by_email(*args, **kwargs):
+        raise AssertionError("Unknown emails must not be looked up")
+
+    monkeypatch.setattr(crud_async, "get_user_by_email", get_user_by_email)
+    # Rejected once the filter is synced.
+    get_default_services().known_emails._next_refresh = 0
+    resp = client.post(
+        "/token", data={"username": "nobody@example.com", "password": "fake_pass_123"}
+    )
+    assert resp.status_code == status.HTTP_401_UNAUTHORIZED
+    assert resp.json() == {"detail": "Incorrect username or password"}
+
+
+def test_login_picks_up_users_created_elsewhere(client: TestClient, db: Session):
+    resp = client.post(
+        "/token", data={"username": "admin@example.com", "password": "admin"}
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    # Bypasses crud, as if another worker had created the user.
+    email = "dora@example.com"
+    db.execute(
+        models.User.__table__.insert().values(
+            email=email,
+            hashed_password=security.get_password_hash(db, "fake_pass_123"),
+            is_active=True,
+            is_superuser=False,
+        )
+    )
+    db.commit()
+    get_default_services().known_emails._next_refresh = 0
+
+    resp = client.post("/token", data={"username": email, "password": "fake_pass_123"})
+    assert resp.status_code == status.HTTP_200_OK
+
+
+def test_login_looks_up_misses_between_refreshes(
+    client: TestClient, db: Session, monkeypatch
+):
+    resp = client.post(
+        "/token", data={"username": "admin@example.com", "password": "admin"}
+    )
+    assert resp.status_code == status.HTTP_200_OK
+    email = "finn@example.com"
+    db.execute(
+        models.User.__table__.insert().values(
+            email=email,
+            hashed_password=security.get_password_hash(db, "fake_pass_123"),
+            is_active=True,
+            is_superuser=False,
+        )
+    )
+    db.commit()
+    # Created by another worker right after this one refreshed its filter.
+    monkeypatch.setattr(
+        get_default_services().known_emails, "claim_refresh", lambda: None
+    )
+
+    resp = client.post("/token", data={"username": email, "password": "fake_pass_123"})
+    assert resp.status_code == status.HTTP_200_OK
+
+
+def test_login_picks_up_emails_changed_elsewhere(client: TestClient, db: Session):
+    email = "eve@example.com"
+    password = "fake_pass_123"
+    user = crud.create_user(db, schemas.UserCreate(email=email, password=password))
+    # Registered long ago, refreshes do not read back that far.
+    db.execute(
+        models.User.__table__.update()
+        .where(models.User.id == user.id)
+        .values(email_changed_at=datetime.utcnow() - timedelta(days=1))
+    )
+    db.commit()
+    resp = client.post("/token", data={"username": email, "password": password})
+    assert resp.status_code == status.HTTP_200_OK
+    # Another worker, with a filter of its own, changes the email.
+    other_worker = Services.from_settings(settings)
+    other_db = other_worker.database.session_factory()
+    try:
+        crud.update_user(other_db, db_obj=user, obj_in={"email": "eve.new@example.com"})
+    finally:
+        other_db.close()
+        other_worker.database.engine.dispose()
+    get_default_services().known_emails._next_refresh = 0
+
+    resp = client.post(
+        "/token", data={"username": "eve.new@example.com", "password": password}
+    )
+    assert resp.status_code == status.HTTP_200_OK
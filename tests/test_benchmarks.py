@@ -0,0 +1,23 @@
+from benchmarks.compare import compare
+from benchmarks.harness import summarize
+
+
+def test_summarize_uses_nearest_rank_percentiles():
+    stats = summarize([i / 1000 for i in range(1, 101)], elapsed=2.0, errors=1)
+    assert stats["count"] == 100
+    assert stats["errors"] == 1
+    assert stats["ops_per_second"] == 50
+    assert (stats["p50_ms"], stats["p90_ms"], stats["p99_ms"]) == (50, 90, 99)
+    assert stats["max_ms"] == 100
+
+
+def test_compare_flags_median_regressions():
+    baseline = {"results": {"a": {"p50_ms": 1.0}, "b": {"p50_ms": 2.0}}}
+    current = {
+        "results": {"a": {"p50_ms": 1.05}, "b": {"p50_ms": 3.0}, "c": {"p50_ms": 1.0}}
+    }
+    lines, regressed = compare(baseline, current, threshold=0.1)
+    assert regressed
+    assert "REGRESSION" not in lines[1]
+    assert lines[2].endswith("REGRESSION")
+    assert lines[3].split()[-1] == "new"
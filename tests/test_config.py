@@ -0,0 +1,29 @@
+from datetime import timedelta
+
+import pytest
+from pydantic import ValidationError
+
+from oauth_app.app.config import Settings
+
+
+def test_missing_secret_key_fails_fast(monkeypatch):
+    monkeypatch.delenv("SECRET_KEY")
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+def test_unsupported_algorithm_fails_fast(monkeypatch):
+    monkeypatch.setenv("ALGORITHM", "none")
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+def test_access_token_expires_is_precomputed(monkeypatch):
+    monkeypatch.setenv("ACCESS_TOKEN_EXPIRE_MINUTES", "45")
+    assert Settings().access_token_expires == timedelta(minutes=45)
+
+
+def test_unsupported_password_hash_scheme_fails_fast(monkeypatch):
+    monkeypatch.setenv("PASSWORD_HASH_SCHEME", "md5_crypt")
+    with pytest.raises(ValidationError):
+        Settings()
@@ -0,0 +1,99 @@
+import json
+from pathlib import Path
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, rsa
+from fastapi import status
+from fastapi.testclient import TestClient
+from jose import JWTError, jwt
+
+from oauth_app.app.cache import TTLCache
+from oauth_app.app.config import Settings, settings
+from oauth_app.app.keys import KeyRing
+from oauth_app.app.tokens import TokenService
+
+
+def write_private_key(path: Path, key) -> None:
+    path.write_bytes(
+        key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        )
+    )
+
+
+@pytest.fixture
+def keys_dir(tmp_path: Path) -> Path:
+    write_private_key(tmp_path / "rsa-1.pem", rsa.generate_private_key(65537, 2048))
+    write_private_key(tmp_path / "ec-1.pem", ec.generate_private_key(ec.SECP256R1()))
+    return tmp_path
+
+
+def uncached_tokens(ring: KeyRing) -> TokenService:
+    return TokenService(settings, ring, TTLCache(maxsize=0, ttl=0))
+
+
+def test_sign_and_verify_with_active_kid(keys_dir: Path):
+    ring = KeyRing.from_settings(
+        Settings(JWT_KEYS_DIR=str(keys_dir), JWT_ACTIVE_KID="ec-1")
+    )
+    tokens = uncached_tokens(ring)
+
+    token = tokens.create_access_token({"sub": "a@example.com"})
+    assert jwt.get_unverified_header(token) == {
+        "alg": "ES256",
+        "typ": "JWT",
+        "kid": "ec-1",
+    }
+    assert tokens.decode_access_token(token)["sub"] == "a@example.com"
+
+
+def test_tokens_from_rotated_out_kid_still_verify(keys_dir: Path):
+    old_ring = KeyRing.from_settings(
+        Settings(JWT_KEYS_DIR=str(keys_dir), JWT_ACTIVE_KID="rsa-1")
+    )
+    token = uncached_tokens(old_ring).create_access_token({"sub": "a@example.com"})
+
+    new_ring = KeyRing.from_settings(
+        Settings(JWT_KEYS_DIR=str(keys_dir), JWT_ACTIVE_KID="ec-1")
+    )
+    assert (
+        uncached_tokens(new_ring).decode_access_token(token)["sub"] == "a@example.com"
+    )
+
+
+def test_unknown_kid_is_rejected(keys_dir: Path):
+    ring = KeyRing.from_settings(
+        Settings(JWT_KEYS_DIR=str(keys_dir), JWT_ACTIVE_KID="ec-1")
+    )
+    token = uncached_tokens(ring).create_access_token({"sub": "a@example.com"})
+    (keys_dir / "ec-1.pem").unlink()
+    tokens = uncached_tokens(
+        KeyRing.from_settings(Settings(JWT_KEYS_DIR=str(keys_dir)))
+    )
+
+    with pytest.raises(JWTError):
+        tokens.decode_access_token(token)
+
+
+def test_jwks_only_publishes_public_keys(keys_dir: Path):
+    ring = KeyRing.from_settings(
+        Settings(JWT_KEYS_DIR=str(keys_dir), JWT_ACTIVE_KID="ec-1")
+    )
+    jwks = json.loads(ring.jwks)
+
+    assert {k["kid"] for k in jwks["keys"]} == {"ec-1", "rsa-1"}
+    for public_jwk in jwks["keys"]:
+        assert "d" not in public_jwk
+
+
+def test_get_jwks_honours_etag(client: TestClient):
+    resp = client.get("/.well-known/jwks.json")
+    assert resp.status_code == status.HTTP_200_OK
+    assert "keys" in resp.json()
+
+    etag = resp.headers["ETag"]
+    resp = client.get("/.well-known/jwks.json", headers={"If-None-Match": etag})
+    assert resp.status_code == status.HTTP_304_NOT_MODIFIED
@@ -0,0 +1,70 @@
+from datetime import datetime
+
+from oauth_app.app.known_emails import BloomFilter, KnownEmails
+
+from tests.utils import FakeClock
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    emails = [f"user{i}@example.com" for i in range(1000)]
+    for email in emails:
+        bloom.add(email)
+
+    assert all(email in bloom for email in emails)
+    false_positives = sum(f"other{i}@example.com" in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_known_emails_sync():
+    clock = FakeClock()
+    known = KnownEmails(
+        capacity=100,
+        error_rate=0.001,
+        refresh_interval=5,
+        rebuild_interval=60,
+        lookback=30,
+        clock=clock,
+    )
+    # Nothing can be ruled out before the first build.
+    assert known.might_contain("ann@example.com")
+    assert known.claim_refresh() is None
+
+    assert known.claim_rebuild()
+    assert not known.claim_rebuild()
+    known.rebuild(
+        2,
+        [
+            ("ann@example.com", datetime(2026, 1, 1, 12, 0, 0)),
+            ("bob@example.com", datetime(2026, 1, 1, 12, 5, 0)),
+        ],
+    )
+    assert known.might_contain("ann@example.com")
+    assert not known.might_contain("cy@example.com")
+    known.add("cy@example.com")
+    assert known.might_contain("cy@example.com")
+
+    assert known.claim_refresh() is None
+    clock.now += 5
+    # Reads back far enough to catch changes that committed late.
+    assert known.claim_refresh() == datetime(2026, 1, 1, 12, 4, 30)
+    known.apply([("dee@example.com", datetime(2026, 1, 1, 12, 7, 0))])
+    assert known.might_contain("dee@example.com")
+    clock.now += 5
+    assert known.claim_refresh() == datetime(2026, 1, 1, 12, 6, 30)
+
+
+def test_failed_rebuild_is_retried():
+    clock = FakeClock()
+    known = KnownEmails(
+        capacity=100,
+        error_rate=0.001,
+        refresh_interval=5,
+        rebuild_interval=60,
+        clock=clock,
+    )
+    assert known.claim_rebuild()
+    known.rebuild_failed()
+    assert not known.claim_rebuild()
+    clock.now += 5
+    assert known.claim_rebuild()
@@ -0,0 +1,82 @@
+import time
+
+from fastapi import APIRouter, FastAPI
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, validator
+
+from oauth_app.app.metrics import (
+    RESPONSE_BUILD_SECONDS,
+    CallbackMetric,
+    Histogram,
+    Registry,
+    TimedRoute,
+)
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.register(
+        Histogram("job_seconds", "Job time.", ("job",), buckets=(0.1, 1))
+    )
+    child = histogram.labels("a")
+    for value in (0.05, 0.5, 5):
+        child.observe(value)
+
+    lines = registry.render().splitlines()
+    assert lines[:2] == ["# HELP job_seconds Job time.", "# TYPE job_seconds histogram"]
+    assert lines[2:] == [
+        'job_seconds_bucket{job="a",le="0.1"} 1',
+        'job_seconds_bucket{job="a",le="1"} 2',
+        'job_seconds_bucket{job="a",le="+Inf"} 3',
+        'job_seconds_sum{job="a"} 5.55',
+        'job_seconds_count{job="a"} 3',
+    ]
+
+
+def test_callback_metric_escapes_label_values():
+    registry = Registry()
+    registry.register(
+        CallbackMetric(
+            "queue_depth", "Depth.", ("queue",), lambda: [(('say "hi"',), 3)]
+        )
+    )
+    assert registry.render().splitlines()[-1] == 'queue_depth{queue="say \\"hi\\""} 3'
+
+
+class SlowModel(BaseModel):
+    name: str
+
+    @validator("name")
+    def slow_validation(cls, v: str) -> str:
+        time.sleep(0.05)
+        return v
+
+
+def test_response_build_covers_response_model_validation():
+    router = APIRouter(route_class=TimedRoute)
+
+    @router.get("/async", response_model=SlowModel)
+    async def read_async():
+        return {"name": "a"}
+
+    @router.get("/sync", response_model=SlowModel)
+    def read_sync():
+        return {"name": "s"}
+
+    @router.get("/raw")
+    async def read_raw():
+        return PlainTextResponse("raw")
+
+    app = FastAPI()
+    app.include_router(router)
+    client = TestClient(app)
+    counts, total = RESPONSE_BUILD_SECONDS.labels().snapshot()
+
+    for path in ("/async", "/sync", "/raw"):
+        assert client.get(path).status_code == 200
+
+    new_counts, new_total = RESPONSE_BUILD_SECONDS.labels().snapshot()
+    # The raw response is not built by FastAPI and not observed.
+    assert sum(new_counts) - sum(counts) == 2
+    assert new_total - total >= 0.1
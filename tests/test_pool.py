@@ -0,0 +1,23 @@
+import sqlite3
+
+import pytest
+from sqlalchemy.exc import TimeoutError
+
+from oauth_app.app.database.pool import TimedQueuePool
+
+
+def test_pool_stats_record_checkout_waits():
+    pool = TimedQueuePool(
+        lambda: sqlite3.connect(":memory:"), pool_size=1, max_overflow=0, timeout=0.05
+    )
+    conn = pool.connect()
+    with pytest.raises(TimeoutError):
+        pool.connect()
+
+    stats = pool.stats()
+    assert stats["checked_out"] == 1
+    assert stats["checkouts"] == 2
+    assert stats["timeouts"] == 1
+    assert stats["wait_seconds_max"] >= 0.05
+    conn.close()
+    assert pool.stats()["checked_in"] == 1
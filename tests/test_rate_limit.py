@@ -0,0 +1,54 @@
+import asyncio
+
+from oauth_app.app.rate_limit import MemoryRateLimiter, load_rate_limiter
+
+from tests.utils import FakeClock
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_limiter_allows_burst_then_spaces_hits():
+    clock = FakeClock()
+    limiter = MemoryRateLimiter(limit=3, period=60, clock=clock)
+
+    assert [run(limiter.hit("a")) for _ in range(3)] == [0, 0, 0]
+    assert run(limiter.hit("a")) == 20
+    assert run(limiter.check("a")) == 20
+    # Other keys are unaffected.
+    assert run(limiter.hit("b")) == 0
+
+    clock.now += 20
+    assert run(limiter.hit("a")) == 0
+    assert run(limiter.hit("a")) == 20
+
+
+def test_limiter_check_and_reset():
+    clock = FakeClock()
+    limiter = MemoryRateLimiter(limit=1, period=10, clock=clock)
+
+    assert run(limiter.check("a")) == 0
+    assert run(limiter.check("a")) == 0
+    run(limiter.hit("a"))
+    assert run(limiter.check("a")) == 10
+    run(limiter.reset("a"))
+    assert run(limiter.check("a")) == 0
+
+
+def test_limiter_evicts_recovered_keys():
+    clock = FakeClock()
+    limiter = MemoryRateLimiter(limit=2, period=10, clock=clock)
+    run(limiter.hit("a"))
+    run(limiter.hit("b"))
+    assert len(limiter) == 2
+
+    clock.now += 10
+    run(limiter.hit("c"))
+    assert len(limiter) == 1
+
+
+def test_load_rate_limiter_from_dotted_path():
+    limiter = load_rate_limiter("oauth_app.app.rate_limit.MemoryRateLimiter", 5, 60)
+    assert isinstance(limiter, MemoryRateLimiter)
+    assert (limiter.limit, limiter.period) == (5, 60)
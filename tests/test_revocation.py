@@ -0,0 +1,50 @@
+from datetime import datetime, timedelta
+
+from oauth_app.app import models
+from oauth_app.app.revocation import RevocationIndex
+
+from tests.utils import FakeClock
+
+
+def revocation(id: int, expires_at: datetime, **columns) -> models.TokenRevocation:
+    return models.TokenRevocation(id=id, user_id=1, expires_at=expires_at, **columns)
+
+
+def test_refresh_rereads_the_lookback_window():
+    clock = FakeClock()
+    index = RevocationIndex(refresh_interval=5, lookback=10, clock=clock)
+    expires_at = datetime.utcfromtimestamp(clock.now + 60)
+
+    assert index.claim_refresh() == 0
+    index.apply([revocation(25, expires_at, jti="b")])
+    clock.now += 5
+    assert index.claim_refresh() == 15
+
+    # Row 20 committed after row 25 was read, the lookback still finds it.
+    index.apply(
+        [revocation(20, expires_at, jti="a"), revocation(25, expires_at, jti="b")]
+    )
+    assert index.is_revoked({"jti": "a"})
+    assert index.is_revoked({"jti": "b"})
+    clock.now += 5
+    assert index.claim_refresh() == 15
+
+
+def test_expired_revocations_are_dropped():
+    clock = FakeClock()
+    index = RevocationIndex(refresh_interval=5, clock=clock)
+    expires_at = datetime.utcfromtimestamp(clock.now + 60)
+    index.apply(
+        [revocation(1, expires_at, jti="a"), revocation(2, expires_at, generation=3)]
+    )
+    assert index.is_revoked({"jti": "a"})
+    assert index.is_revoked({"uid": 1, "gen": 2})
+    assert not index.is_revoked({"uid": 1, "gen": 3})
+
+    clock.now += 60
+    index.apply([])
+    assert not index.is_revoked({"jti": "a"})
+    assert not index.is_revoked({"uid": 1, "gen": 2})
+    # Rows that expired before they were read are not added.
+    index.apply([revocation(3, expires_at, jti="c")])
+    assert not index.is_revoked({"jti": "c"})
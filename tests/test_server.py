@@ -0,0 +1,51 @@
+import os
+
+from fastapi.testclient import TestClient
+
+from oauth_app import main
+from oauth_app import server
+from oauth_app.app.config import settings
+
+
+def test_server_runs_a_preloaded_worker_per_cpu(monkeypatch):
+    monkeypatch.setattr(os, "cpu_count", lambda: 3)
+    options = server.get_options("127.0.0.1", 8000, None, 30)
+    assert options["workers"] == 3
+    assert options["preload_app"] is True
+    assert options["worker_class"] == "uvicorn.workers.UvicornWorker"
+
+
+def test_server_applies_its_options():
+    app = server.Server(server.get_options("127.0.0.1", 8001, 2, 10, "10.0.0.1"))
+    assert app.cfg.address == [("127.0.0.1", 8001)]
+    assert app.cfg.workers == 2
+    assert app.cfg.graceful_timeout == 10
+    assert app.cfg.preload_app
+    assert app.cfg.forwarded_allow_ips == ["10.0.0.1"]
+
+
+def test_startup_warms_up_the_pools(monkeypatch):
+    warmed = []
+
+    async def warm_up_async(connections: int) -> None:
+        warmed.append(connections)
+
+    database = main.app.state.services.database
+    monkeypatch.setattr(database, "warm_up", warmed.append)
+    monkeypatch.setattr(database, "warm_up_async", warm_up_async)
+    with TestClient(main.app):
+        assert warmed == [settings.DB_POOL_WARMUP]
+
+
+def test_parse_importtime():
+    output = "\n".join(
+        [
+            "import time: self [us] | cumulative | imported package",
+            "import time:       120 |        120 |   jose.constants",
+            "import time:      1500 |       1620 | jose",
+        ]
+    )
+    assert server.parse_importtime(output) == [
+        ("jose.constants", 120, 120),
+        ("jose", 1500, 1620),
+    ]
@@ -0,0 +1,95 @@
+from pathlib import Path
+
+from fastapi import status
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from oauth_app.app import crud
+from oauth_app.app import schemas
+from oauth_app.app import security
+from oauth_app.app.config import Settings, settings
+from oauth_app.app.database.base import Base
+from oauth_app.app.services import Services, get_default_services, services_of
+from oauth_app.main import create_app
+
+
+def tenant_services(path: Path) -> Services:
+    services = Services.from_settings(
+        Settings(DATABASE_URL=f"sqlite:///{path}", DATABASE_ASYNC=False)
+    )
+    Base.metadata.create_all(services.database.engine)
+    return services
+
+
+def test_apps_do_not_share_services(tmp_path: Path):
+    tenant_a = tenant_services(tmp_path / "a.db")
+    tenant_b = tenant_services(tmp_path / "b.db")
+    db = tenant_a.database.session_factory()
+    try:
+        assert services_of(db) is tenant_a
+        crud.create_user(
+            db, schemas.UserCreate(email="ann@example.com", password="fake_pass_123")
+        )
+    finally:
+        db.close()
+    login_data = {"username": "ann@example.com", "password": "fake_pass_123"}
+
+    with TestClient(create_app(services=tenant_a)) as client_a, TestClient(
+        create_app(services=tenant_b)
+    ) as client_b:
+        resp = client_a.post("/token", data=login_data)
+        assert resp.status_code == status.HTTP_200_OK
+        headers = {"Authorization": f"Bearer {resp.json()['access_token']}"}
+        assert client_a.get("/users/me", headers=headers).status_code == 200
+
+        assert client_b.post("/token", data=login_data).status_code == 401
+        # Tenant a's principal is cached by tenant a only.
+        assert client_b.get("/users/me", headers=headers).status_code == 401
+
+    assert tenant_a.principal_cache.get("ann@example.com") is not None
+    assert tenant_b.principal_cache.get("ann@example.com") is None
+    assert tenant_a.database.engine is not tenant_b.database.engine
+
+
+def test_sessions_without_services_use_the_defaults():
+    assert services_of(Session()) is get_default_services()
+    assert get_default_services().settings is settings
+
+
+def test_apps_hash_passwords_with_their_own_settings(tmp_path: Path):
+    tenant = Services.from_settings(
+        Settings(
+            DATABASE_URL=f"sqlite:///{tmp_path / 'a.db'}",
+            DATABASE_ASYNC=False,
+            BCRYPT_ROUNDS=settings.BCRYPT_ROUNDS - 1,
+        )
+    )
+    db = tenant.database.session_factory()
+    try:
+        hashed_password = security.get_password_hash(db, "fake_pass_123")
+        assert security.verify_password(db, "fake_pass_123", hashed_password)
+    finally:
+        db.close()
+        tenant.hasher.shutdown()
+    assert hashed_password.startswith(f"$2b${settings.BCRYPT_ROUNDS - 1:02d}$")
+
+
+def test_apps_only_run_their_own_lifecycle_handlers(tmp_path: Path, monkeypatch):
+    tenant_a = tenant_services(tmp_path / "a.db")
+    tenant_b = tenant_services(tmp_path / "b.db")
+    app_a = create_app(services=tenant_a)
+    app_b = create_app(services=tenant_b)
+    for app in (app_a, app_b):
+        assert len(app.router.on_startup) == 1
+        assert len(app.router.on_shutdown) == 1
+    shut_down = []
+    monkeypatch.setattr(tenant_a, "shutdown", lambda: shut_down.append(tenant_a))
+
+    with TestClient(app_b):
+        pass
+
+    # Shutting tenant b down leaves tenant a's hashing pool and engine usable.
+    assert shut_down == []
+    assert tenant_a.hasher.run(len, "pass") == 4
+    with tenant_a.database.engine.connect() as conn:
+        assert conn.exec_driver_sql("SELECT 1").scalar() == 1
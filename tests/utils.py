@@ -10,6 +10,16 @@ from oauth_app.app import crud
 from oauth_app.app import schemas
 
 
+class FakeClock:
+    """A clock that only moves when a test sets `now`."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
 def wait_until_responsive(
     check_func: Callable[[], bool],
     timeout: int = 30,